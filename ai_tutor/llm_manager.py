@@ -1,29 +1,108 @@
 """
 LLM management for the AI tutor system
 """
+import asyncio
+import importlib.util
 import logging
 import os
-from typing import Dict, Any
-from langchain_community.llms import HuggingFacePipeline, HuggingFaceHub
-from langchain_google_genai import ChatGoogleGenerativeAI
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
-import torch
+import re
+import threading
+import weakref
+from functools import lru_cache
+from typing import Dict, Any, Optional
+from cachetools import LRUCache
 
 logger = logging.getLogger(__name__)
 
+_ARTIFACT_RE = re.compile(r"<\|endoftext\|>|</?s>")
+
+_FALLBACK_RESPONSES = (
+    "I understand you're asking about that topic. Let me help you learn step by step.",
+    "That's a great question! Let me break it down for you.",
+    "I can see you're working on this concept. Here's how I'd explain it:",
+    "Let's explore this together. What specific part would you like to focus on?",
+    "That's an interesting point. Let me provide some guidance on this."
+)
+
+
+@lru_cache(maxsize=1)
+def _get_fallback_llm():
+    """Build the shared fallback LLM on first use"""
+    from langchain_community.llms import FakeListLLM
+    return FakeListLLM(responses=list(_FALLBACK_RESPONSES))
+
+
 class LLMManager:
     """Manages Large Language Model operations"""
     
-    def __init__(self, model_name: str = "gemini-1.5-flash", gemini_api_key: str = "", huggingface_api_token: str = "", use_local: bool = False):
+    LOCAL_MAX_LENGTH = 512
+    LOCAL_MAX_BATCH = 8
+    LOCAL_BATCH_WINDOW = 0.02  # seconds to wait for more prompts before running a batch
+    HUB_GENERATION_KWARGS = {
+        "temperature": 0.7,
+        "max_new_tokens": 512,
+        "top_p": 0.9,
+        "repetition_penalty": 1.05
+    }
+    
+    # Remote clients shared across managers, keyed by (provider, model, credential)
+    _client_pool: Dict[tuple, Any] = {}
+    _client_pool_lock = threading.Lock()
+    
+    # Educational system prompt, split around the student question so formatting is a plain concat
+    _PROMPT_PREFIX = """You are Riya Malhotra, a warm and empathetic AI tutor at EduSmart AI. You help students learn in an interactive, personalized way.
+
+Your personality:
+- Warm, empathetic, and student-centered
+- Focused on long-term learning impact
+- Encouraging and supportive
+- Breaks down complex topics into manageable parts
+- Adapts explanations to student's learning style
+
+Guidelines:
+- Always be encouraging and positive
+- Use simple, clear language
+- Provide examples when explaining concepts
+- Ask follow-up questions to check understanding
+- Relate learning to real-world applications
+- Remember that you're talking to a student who wants to learn
+
+Student question: """
+    _PROMPT_SUFFIX = """
+
+Respond as Riya would, being helpful, encouraging, and educational:"""
+    
+    def __init__(self, model_name: str = "gemini-1.5-flash", gemini_api_key: str = "", huggingface_api_token: str = "", use_local: bool = False,
+                 compile_model: bool = True, compile_mode: str = "reduce-overhead", quantization: Optional[str] = "nf4"):
         self.model_name = model_name
         self.gemini_api_key = gemini_api_key
         self.huggingface_api_token = huggingface_api_token
         self.use_local = use_local
+        self.compile_model = compile_model
+        self.compile_mode = compile_mode
+        self.quantization = quantization
+        # Shared by every Streamlit session thread; cachetools caches need external locking
+        self._response_cache = LRUCache(maxsize=1024)
+        self._response_cache_lock = threading.Lock()
+        self._pipe = None
+        # Event loop -> (prompt queue, worker task); one manager serves every session's loop
+        self._batchers = weakref.WeakKeyDictionary()
+        self._batchers_lock = threading.Lock()
         self.llm = None
         self.tokenizer = None
         self.provider = "unknown"
         self._initialize_model()
     
+    @classmethod
+    def _get_pooled_client(cls, key: tuple, factory):
+        """Return a process-wide remote LLM client so its keep-alive connections are reused"""
+        with cls._client_pool_lock:
+            client = cls._client_pool.get(key)
+            if client is None:
+                client = factory()
+                cls._client_pool[key] = client
+            return client
+    
     def _initialize_model(self):
         """Initialize the language model"""
         try:
@@ -45,16 +124,16 @@ class LLMManager:
     def _initialize_huggingface_hub_model(self):
         """Initialize model via Hugging Face Hub Inference API"""
         try:
+            from langchain_community.llms import HuggingFaceHub
+            
             logger.info(f"Loading Hugging Face Hub model: {self.model_name}")
-            self.llm = HuggingFaceHub(
-                repo_id=self.model_name,
-                huggingfacehub_api_token=self.huggingface_api_token,
-                model_kwargs={
-                    "temperature": 0.7,
-                    "max_new_tokens": 512,
-                    "top_p": 0.9,
-                    "repetition_penalty": 1.05
-                }
+            self.llm = self._get_pooled_client(
+                ("huggingface_hub", self.model_name, self.huggingface_api_token),
+                lambda: HuggingFaceHub(
+                    repo_id=self.model_name,
+                    huggingfacehub_api_token=self.huggingface_api_token,
+                    model_kwargs=dict(self.HUB_GENERATION_KWARGS)
+                )
             )
             self.provider = "huggingface_hub"
             logger.info("Hugging Face Hub model initialized successfully")
@@ -65,33 +144,75 @@ class LLMManager:
     def _initialize_local_model(self):
         """Initialize local Hugging Face model (CPU/GPU)"""
         try:
+            import torch
+            from langchain_community.llms import HuggingFacePipeline
+            from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+            
             logger.info(f"Loading local model: {self.model_name}")
             
             # Load tokenizer and model
+            torch_dtype = self._select_torch_dtype()
             self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            model = AutoModelForCausalLM.from_pretrained(
-                self.model_name,
-                torch_dtype=torch.float32,
-                device_map="auto" if torch.cuda.is_available() else None,
-                low_cpu_mem_usage=True
+            load_kwargs = {
+                "torch_dtype": torch_dtype,
+                "device_map": "auto" if torch.cuda.is_available() else None,
+                "low_cpu_mem_usage": True,
+                "quantization_config": self._build_quantization_config(torch_dtype)
+            }
+            model = self._load_with_fused_attention(AutoModelForCausalLM, load_kwargs)
+            model.eval()
+            
+            model.generation_config.max_length = self.LOCAL_MAX_LENGTH
+            # Preallocate a static KV cache so compiled decoding can be captured as a CUDA graph.
+            # It only pays off with torch.compile on GPU, and generate() rejects it for models
+            # without static cache support. The cache is sized by max_length.
+            use_static_cache = (
+                self.compile_model
+                and torch.cuda.is_available()
+                and getattr(model, "_supports_static_cache", False)
             )
+            if use_static_cache:
+                model.generation_config.cache_implementation = "static"
+            
+            # Compile only the forward pass on GPU to cut per-token Python dispatch overhead.
+            # Wrapping the whole stateful module would hide generate()/generation_config from
+            # the pipeline and recompile whenever module attributes change.
+            eager_forward = model.forward
+            compiled = False
+            if self.compile_model and torch.cuda.is_available():
+                try:
+                    model.forward = torch.compile(eager_forward, mode=self.compile_mode)
+                    compiled = True
+                except Exception as e:
+                    logger.warning(f"torch.compile unavailable, using eager model: {str(e)}")
             
             # Add padding token if not present
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
+            # Decoder-only models must be left-padded for batched generation
+            self.tokenizer.padding_side = "left"
             
             # Create pipeline
             pipe = pipeline(
                 "text-generation",
                 model=model,
                 tokenizer=self.tokenizer,
-                max_length=512,
+                max_length=self.LOCAL_MAX_LENGTH,
                 temperature=0.7,
                 do_sample=True,
                 pad_token_id=self.tokenizer.eos_token_id
             )
             
+            # Warm up the compiled graph so the first student question doesn't pay the compile cost
+            if compiled:
+                try:
+                    pipe("warmup", max_new_tokens=1)
+                except Exception as e:
+                    logger.warning(f"Compiled warmup failed, falling back to eager model: {str(e)}")
+                    model.forward = eager_forward
+            
             # Create LangChain LLM
+            self._pipe = pipe
             self.llm = HuggingFacePipeline(pipeline=pipe)
             self.provider = "local_hf_pipeline"
             logger.info("Local model initialized successfully")
@@ -100,19 +221,87 @@ class LLMManager:
             logger.error(f"Error initializing local model: {str(e)}")
             raise
     
+    def _select_torch_dtype(self):
+        """Pick the narrowest floating point dtype the hardware runs natively"""
+        import torch
+        
+        if torch.cuda.is_available():
+            return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        return torch.float32
+    
+    def _load_with_fused_attention(self, model_cls, load_kwargs: Dict[str, Any]):
+        """Load the model with the fastest available attention kernels"""
+        candidates = [self._select_attn_implementation()]
+        if candidates[0] != "sdpa":
+            candidates.append("sdpa")
+        
+        for attn_implementation in candidates:
+            try:
+                return model_cls.from_pretrained(
+                    self.model_name, attn_implementation=attn_implementation, **load_kwargs
+                )
+            except (ImportError, ValueError) as e:
+                # Model architecture or flash-attn build doesn't support it; try the next option
+                logger.warning(f"{attn_implementation} attention unavailable: {str(e)}")
+        
+        # No native fused attention for this architecture; convert with BetterTransformer if possible
+        model = model_cls.from_pretrained(self.model_name, **load_kwargs)
+        try:
+            from optimum.bettertransformer import BetterTransformer
+            model = BetterTransformer.transform(model, keep_original_model=False)
+            logger.info("Converted local model with BetterTransformer")
+        except Exception as e:
+            logger.warning(f"BetterTransformer unavailable, using eager attention: {str(e)}")
+        return model
+    
+    def _select_attn_implementation(self) -> str:
+        """Use fused Flash Attention 2 kernels on GPU when flash-attn is installed"""
+        import torch
+        
+        if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") is not None:
+            return "flash_attention_2"
+        return "sdpa"
+    
+    def _build_quantization_config(self, compute_dtype):
+        """Build a bitsandbytes config for the requested weight quantization (CUDA only)"""
+        import torch
+        from transformers import BitsAndBytesConfig
+        
+        if not self.quantization or not torch.cuda.is_available():
+            return None
+        
+        quantization = self.quantization.lower()
+        if quantization == "nf4":
+            return BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=compute_dtype
+            )
+        if quantization == "int8":
+            return BitsAndBytesConfig(load_in_8bit=True)
+        
+        logger.warning(f"Unknown quantization '{self.quantization}', loading unquantized weights")
+        return None
+    
     def _initialize_gemini_model(self):
         """Initialize Google Gemini model"""
         try:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            
             logger.info(f"Loading Gemini model: {self.model_name}")
             
             # Set the API key as environment variable
             os.environ["GOOGLE_API_KEY"] = self.gemini_api_key
             
             # Create Gemini LLM (remove deprecated convert_system_message_to_human)
-            self.llm = ChatGoogleGenerativeAI(
-                model=self.model_name,
-                google_api_key=self.gemini_api_key,
-                temperature=0.7
+            self.llm = self._get_pooled_client(
+                ("gemini", self.model_name, self.gemini_api_key),
+                lambda: ChatGoogleGenerativeAI(
+                    model=self.model_name,
+                    google_api_key=self.gemini_api_key,
+                    temperature=0.7
+                )
             )
             self.provider = "gemini"
             logger.info("Gemini model initialized successfully")
@@ -121,22 +310,32 @@ class LLMManager:
             logger.error(f"Error initializing Gemini model: {str(e)}")
             raise
     
+    def get_summarizer_llm(self, model_name: str):
+        """Return a pooled low-temperature Gemini client for conversation summaries, or None"""
+        if self.provider != "gemini":
+            # Summarizing with the main Hub or local model would cost a full generation per turn
+            return None
+        try:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            
+            return self._get_pooled_client(
+                ("gemini_summarizer", model_name, self.gemini_api_key),
+                lambda: ChatGoogleGenerativeAI(
+                    model=model_name,
+                    google_api_key=self.gemini_api_key,
+                    temperature=0.0,
+                    max_output_tokens=256
+                )
+            )
+        except Exception as e:
+            logger.error(f"Error initializing summarizer model: {str(e)}")
+            return None
+    
     def _initialize_fallback_model(self):
         """Initialize a simple fallback model"""
         try:
             logger.info("Initializing fallback model")
-            # Use a very simple model as fallback
-            from langchain_community.llms import FakeListLLM
-            
-            responses = [
-                "I understand you're asking about that topic. Let me help you learn step by step.",
-                "That's a great question! Let me break it down for you.",
-                "I can see you're working on this concept. Here's how I'd explain it:",
-                "Let's explore this together. What specific part would you like to focus on?",
-                "That's an interesting point. Let me provide some guidance on this."
-            ]
-            
-            self.llm = FakeListLLM(responses=responses)
+            self.llm = _get_fallback_llm()
             self.provider = "fallback_fake_llm"
             logger.info("Fallback model initialized")
             
@@ -150,6 +349,11 @@ class LLMManager:
             if not self.llm:
                 raise ValueError("LLM not initialized")
             
+            with self._response_cache_lock:
+                cached = self._response_cache.get(prompt)
+            if cached is not None:
+                return cached
+            
             # Format prompt for educational context
             formatted_prompt = self._format_educational_prompt(prompt)
             
@@ -159,36 +363,112 @@ class LLMManager:
             # Clean and format response
             cleaned_response = self._clean_response(response, prompt)
             
+            with self._response_cache_lock:
+                self._response_cache[prompt] = cleaned_response
+            return cleaned_response
+            
+        except Exception as e:
+            logger.error(f"Error generating response: {str(e)}")
+            return "I apologize, but I'm having trouble generating a response right now. Could you please rephrase your question?"
+    
+    async def agenerate_response(self, prompt: str, max_length: int = 200) -> str:
+        """Generate a response without blocking the event loop"""
+        try:
+            if not self.llm:
+                raise ValueError("LLM not initialized")
+            
+            with self._response_cache_lock:
+                cached = self._response_cache.get(prompt)
+            if cached is not None:
+                return cached
+            
+            formatted_prompt = self._format_educational_prompt(prompt)
+            response = await self.agenerate(formatted_prompt)
+            cleaned_response = self._clean_response(response, prompt)
+            
+            with self._response_cache_lock:
+                self._response_cache[prompt] = cleaned_response
             return cleaned_response
             
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             return "I apologize, but I'm having trouble generating a response right now. Could you please rephrase your question?"
     
+    async def agenerate(self, prompt: str) -> str:
+        """Generate text for an already formatted prompt without blocking the event loop"""
+        if self._pipe is not None:
+            # Local pipeline: share one batched forward pass with other pending prompts
+            return await self._enqueue_local_prompt(prompt)
+        if self.provider == "huggingface_hub":
+            # HuggingFaceHub has no native async call, so go through the async inference client
+            return await self._get_async_hub_client().text_generation(prompt, **self.HUB_GENERATION_KWARGS)
+        # Gemini issues native async requests; other LLMs run in LangChain's executor fallback
+        response = await self.llm.ainvoke(prompt)
+        return getattr(response, "content", response)
+    
+    def _get_async_hub_client(self):
+        """Return the pooled async Hugging Face inference client for this model"""
+        from huggingface_hub import AsyncInferenceClient
+        
+        return self._get_pooled_client(
+            ("huggingface_hub_async", self.model_name, self.huggingface_api_token),
+            lambda: AsyncInferenceClient(model=self.model_name, token=self.huggingface_api_token)
+        )
+    
+    async def _enqueue_local_prompt(self, formatted_prompt: str) -> str:
+        """Queue a prompt for the local pipeline micro-batcher and wait for its completion"""
+        loop = asyncio.get_running_loop()
+        with self._batchers_lock:
+            batcher = self._batchers.get(loop)
+            if batcher is None:
+                # Queues are bound to an event loop; start a worker for this one and hold a strong
+                # reference to its task so it isn't garbage collected while callers await it
+                queue = asyncio.Queue()
+                batcher = (queue, loop.create_task(self._run_local_batches(queue)))
+                self._batchers[loop] = batcher
+        
+        future = loop.create_future()
+        await batcher[0].put((formatted_prompt, future))
+        return await future
+    
+    async def _run_local_batches(self, queue: asyncio.Queue):
+        """Collect prompts for up to LOCAL_BATCH_WINDOW seconds and generate them in one pipeline call"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                batch = [await queue.get()]
+                deadline = loop.time() + self.LOCAL_BATCH_WINDOW
+                while len(batch) < self.LOCAL_MAX_BATCH:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                
+                prompts = [prompt for prompt, _ in batch]
+                try:
+                    outputs = await loop.run_in_executor(
+                        None,
+                        lambda: self._pipe(prompts, batch_size=len(prompts), return_full_text=False)
+                    )
+                    for (_, future), output in zip(batch, outputs):
+                        if not future.done():
+                            future.set_result(output[0]["generated_text"])
+                except Exception as e:
+                    logger.error(f"Error generating local batch: {str(e)}")
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+        finally:
+            # asyncio.run cancels this worker when its loop finishes; forget the loop's batcher then
+            with self._batchers_lock:
+                self._batchers.pop(loop, None)
+    
     def _format_educational_prompt(self, user_input: str) -> str:
         """Format prompt for educational context"""
-        system_prompt = """You are Riya Malhotra, a warm and empathetic AI tutor at EduSmart AI. You help students learn in an interactive, personalized way.
-
-Your personality:
-- Warm, empathetic, and student-centered
-- Focused on long-term learning impact
-- Encouraging and supportive
-- Breaks down complex topics into manageable parts
-- Adapts explanations to student's learning style
-
-Guidelines:
-- Always be encouraging and positive
-- Use simple, clear language
-- Provide examples when explaining concepts
-- Ask follow-up questions to check understanding
-- Relate learning to real-world applications
-- Remember that you're talking to a student who wants to learn
-
-Student question: {user_input}
-
-Respond as Riya would, being helpful, encouraging, and educational:"""
-        
-        return system_prompt.format(user_input=user_input)
+        return self._PROMPT_PREFIX + user_input + self._PROMPT_SUFFIX
     
     def _clean_response(self, response: str, original_prompt: str) -> str:
         """Clean and format the model response"""
@@ -197,17 +477,15 @@ Respond as Riya would, being helpful, encouraging, and educational:"""
             if original_prompt in response:
                 response = response.replace(original_prompt, "").strip()
             
-            # Remove common artifacts
-            response = response.replace("<|endoftext|>", "")
-            response = response.replace("</s>", "")
-            response = response.replace("<s>", "")
+            # Remove common artifacts in a single scan
+            response = _ARTIFACT_RE.sub("", response)
             
             # Ensure response starts appropriately
             if not response:
                 response = "I'd be happy to help you with that! Could you provide a bit more detail about what you'd like to learn?"
             
             # Limit response length
-            sentences = response.split('. ')
+            sentences = response.split('. ', 4)
             if len(sentences) > 4:
                 response = '. '.join(sentences[:4]) + '.'
             
@@ -223,6 +501,8 @@ Respond as Riya would, being helpful, encouraging, and educational:"""
             'model_name': self.model_name,
             'provider': self.provider,
             'use_local': self.use_local,
+            'compile_model': self.compile_model,
+            'quantization': self.quantization,
             'is_initialized': self.llm is not None,
             'tokenizer_available': self.tokenizer is not None
         }
\ No newline at end of file
@@ -2,19 +2,119 @@
 RAG (Retrieval-Augmented Generation) pipeline for the AI tutor
 """
 
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional
+import re
+import threading
+from typing import Dict, Any, Iterator, List, Optional
+
+import numpy as np
+from cachetools import TTLCache
 
 from langchain.chains import ConversationalRetrievalChain, LLMChain
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
+from langchain_core.messages import get_buffer_string
 
-from utils.vector_store import VectorStoreManager
+from utils.vector_store import VectorStoreManager, make_preview
 from utils.conversation_memory import ConversationMemoryManager
 from ai_tutor.llm_manager import LLMManager
 
+try:
+    import ahocorasick
+except ImportError:  # Optional: fall back to token set intersection
+    ahocorasick = None
+
+try:
+    from numba import njit
+except ImportError:  # Optional: run the kernels as plain NumPy
+    def njit(*args, **kwargs):
+        return lambda func: func
+
 logger = logging.getLogger(__name__)
 
+# Subject names and irregular forms are listed explicitly; regular plurals are handled by the matchers
+SUBJECT_KEYWORDS: Dict[str, frozenset] = {
+    "mathematics": frozenset({"math", "maths", "mathematics", "algebra", "geometry", "calculus", "equation",
+                              "solve", "calculate", "calculation"}),
+    "science": frozenset({"science", "scientific", "physics", "chemistry", "biology", "experiment", "theory",
+                          "theories"}),
+    "english": frozenset({"english", "literature", "writing", "grammar", "essay", "reading"}),
+    "history": frozenset({"history", "historical", "past", "ancient", "war", "civilization"}),
+    "computer": frozenset({"computer", "computing", "programming", "coding", "code", "algorithm", "software"}),
+}
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def _build_subject_matcher():
+    """Compile all subject keywords into one Aho-Corasick automaton"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for subject, keywords in SUBJECT_KEYWORDS.items():
+        for keyword in keywords:
+            automaton.add_word(keyword, (keyword, subject))
+    automaton.make_automaton()
+    return automaton
+
+
+# Built once at import and shared by every pipeline
+_SUBJECT_MATCHER = _build_subject_matcher()
+
+
+def match_subjects(query: str, matcher=_SUBJECT_MATCHER) -> List[str]:
+    """Subjects whose keywords start a word of the query, in SUBJECT_KEYWORDS order"""
+    query_lower = query.lower()
+    if matcher is not None:
+        # One pass over the query; a hit counts only at the start of a word, so "math" matches
+        # "mathematics" and "algorithm" "algorithms" but "war" no longer matches "software"
+        matched = {
+            subject
+            for end, (keyword, subject) in matcher.iter(query_lower)
+            if end < len(keyword) or not query_lower[end - len(keyword)].isalpha()
+        }
+    else:
+        tokens = set(_WORD_RE.findall(query_lower))
+        # Strip a plural "s" so "equations" and "experiments" meet their keywords by intersection
+        tokens.update([token[:-1] for token in tokens if token.endswith("s")])
+        matched = {subject for subject, keywords in SUBJECT_KEYWORDS.items() if keywords & tokens}
+    return [subject for subject in SUBJECT_KEYWORDS if subject in matched]
+
+
+@njit(cache=True)
+def _confidence_kernel(is_pdf: np.ndarray, has_subject: np.ndarray) -> float:
+    """Score retrieved sources from their per-document quality flags"""
+    # Simple confidence calculation based on number and quality of sources
+    base_confidence = min(0.9, 0.5 + len(is_pdf) * 0.1)
+    quality_bonus = 0.05 * (is_pdf.sum() + has_subject.sum())
+    return min(1.0, base_confidence + quality_bonus)
+
+
+# Compile the kernel at import so the first student query doesn't wait on the JIT
+_confidence_kernel(np.zeros(1, dtype=np.bool_), np.zeros(1, dtype=np.bool_))
+
+
+class AnswerCache:
+    """Thread-safe TTL cache of chain answers, shared by every student's pipeline"""
+
+    def __init__(self, maxsize: int = 2048, ttl: int = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._cache.get(key)
+
+    def put(self, key: bytes, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._cache[key] = value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
 
 class RAGPipeline:
     """RAG pipeline for educational content retrieval and generation"""
@@ -24,32 +124,37 @@ class RAGPipeline:
         vector_store_manager: VectorStoreManager,
         llm_manager: LLMManager,
         memory_manager: ConversationMemoryManager,
+        answer_cache: Optional[AnswerCache] = None,
+        answer_cache_size: int = 2048,
+        answer_cache_ttl: int = 3600,
     ):
         self.vector_store_manager = vector_store_manager
         self.llm_manager = llm_manager
         self.memory_manager = memory_manager
         self.chain = None
+        self._prompt_template = self._create_prompt_template()
+        self._answer_cache = answer_cache if answer_cache is not None else AnswerCache(answer_cache_size, answer_cache_ttl)
         self._initialize_chain()
 
     def _initialize_chain(self):
         """Initialize the conversational retrieval chain"""
         try:
-            # Create custom prompt template
-            prompt_template = self._create_prompt_template()
-
             # Get retriever
             retriever = self.vector_store_manager.get_retriever(
                 search_kwargs={"k": 4}
             )
 
-            # Create conversational retrieval chain
+            # Create conversational retrieval chain. It gets no memory of its own: prep_inputs would
+            # replace the chat_history we pass with the full memory, and saving context there would
+            # record every turn twice. _build_chain_inputs passes the bounded window and
+            # _build_response writes each turn to memory once.
             self.chain = ConversationalRetrievalChain.from_llm(
                 llm=self.llm_manager.llm,
                 retriever=retriever,
-                memory=self.memory_manager.memory,
-                combine_docs_chain_kwargs={"prompt": prompt_template},
+                memory=None,
+                combine_docs_chain_kwargs={"prompt": self._prompt_template},
                 return_source_documents=True,
-                verbose=True,
+                verbose=logger.isEnabledFor(logging.DEBUG),
             )
 
             logger.info("RAG pipeline initialized successfully")
@@ -76,7 +181,7 @@ class RAGPipeline:
             self.chain = LLMChain(
                 llm=self.llm_manager.llm,
                 prompt=prompt_template,
-                verbose=True,
+                verbose=logger.isEnabledFor(logging.DEBUG),
             )
 
             logger.info("Fallback RAG pipeline initialized")
@@ -116,84 +221,275 @@ Respond as Riya would - warm, educational, and focused on the student's learning
             template=template,
         )
 
-    def query(self, question: str, subject_filter: Optional[str] = None) -> Dict[str, Any]:
+    def query(
+        self,
+        question: str,
+        subject_filter: Optional[str] = None,
+        precomputed_embedding: Optional[List[float]] = None,
+    ) -> Dict[str, Any]:
         """Process a student query through the RAG pipeline"""
         try:
-            # Get personalized context
-            student_context = self.memory_manager.get_personalized_context()
-
-            # Prepare input
-            if hasattr(self.chain, "invoke"):
-                # For ConversationalRetrievalChain
-                # ConversationalRetrievalChain supports chat_history; pass it along and include student context in the question
-                chat_history = self.memory_manager.get_memory_variables().get("chat_history", [])
-                composed_question = f"STUDENT CONTEXT: {student_context}\n\nQUESTION: {question}"
-                inputs = {
-                    "question": composed_question,
-                    "chat_history": chat_history,
-                }
-                result = self.chain.invoke(inputs)
-            else:
-                # For simple LLMChain fallback
-                chat_history = self.memory_manager.get_conversation_context()
-                result_text = self.chain.run(question=question, chat_history=chat_history)
-                result = {"answer": result_text, "source_documents": []}
-
-            # Extract response and sources
-            answer = result.get("answer", "I'm sorry, I couldn't generate a response.")
-            source_docs = result.get("source_documents", [])
-
-            # Add interaction to memory
-            metadata = {
-                "subject": subject_filter,
-                "num_sources": len(source_docs),
-                "sources": [doc.metadata.get("source_file", "unknown") for doc in source_docs],
-            }
-            self.memory_manager.add_interaction(question, answer, metadata)
-
-            response = {
-                "answer": answer,
-                "sources": self._format_sources(source_docs),
-                "student_profile": self.memory_manager.get_student_profile_summary(),
-                "confidence": self._calculate_confidence(source_docs),
-            }
-
-            logger.info(f"Processed query successfully with {len(source_docs)} sources")
-            return response
+            cache_key = self._answer_cache_key(question, subject_filter)
+            result = self._answer_cache.get(cache_key)
+            if result is None:
+                if precomputed_embedding is not None and isinstance(self.chain, ConversationalRetrievalChain):
+                    # Standalone canned question: retrieve by its cached vector, skipping the encoder
+                    result = self._answer_from_embedding(question, precomputed_embedding)
+                elif hasattr(self.chain, "invoke"):
+                    # For ConversationalRetrievalChain
+                    result = self.chain.invoke(self._build_chain_inputs(question))
+                else:
+                    # For simple LLMChain fallback
+                    chat_history = self.memory_manager.get_conversation_context()
+                    result_text = self.chain.run(question=question, chat_history=chat_history)
+                    result = {"answer": result_text, "source_documents": []}
+                self._cache_answer(cache_key, result)
+
+            return self._build_response(question, subject_filter, result)
         except Exception as e:
             logger.error(f"Error processing query: {str(e)}")
             # Fallback: try generating a response without retrieval using the LLM manager
             try:
                 fallback_answer = self.llm_manager.generate_response(question)
-                return {
-                    "answer": fallback_answer,
-                    "sources": [],
-                    "student_profile": self.memory_manager.get_student_profile_summary(),
-                    "confidence": 0.3,
-                }
+                return self._fallback_response(fallback_answer, 0.3)
             except Exception as inner_e:
                 logger.error(f"Fallback generation failed: {str(inner_e)}")
-                return {
-                    "answer": "I apologize, but I'm having trouble processing your question right now. Could you please try rephrasing it?",
-                    "sources": [],
-                    "student_profile": self.memory_manager.get_student_profile_summary(),
-                    "confidence": 0.0,
-                }
+                return self._fallback_response(
+                    "I apologize, but I'm having trouble processing your question right now. Could you please try rephrasing it?",
+                    0.0,
+                )
+
+    def query_stream(
+        self,
+        question: str,
+        subject_filter: Optional[str] = None,
+        final_response: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        """Stream the answer text as it is generated; ``final_response`` is filled in at the end"""
+        final_response = final_response if final_response is not None else {}
+        parts = []
+        source_docs = []
+        try:
+            cache_key = self._answer_cache_key(question, subject_filter)
+            result = self._answer_cache.get(cache_key)
+            if result is not None:
+                yield result["answer"]
+            else:
+                if isinstance(self.chain, ConversationalRetrievalChain):
+                    # Same prompt as query(): the condensed question in the chain's combine-docs prompt
+                    standalone_question = self._condense_question(self._build_chain_inputs(question))
+                    source_docs = self.chain.retriever.invoke(standalone_question)
+                    prompt = self._answer_prompt(standalone_question, source_docs)
+                else:
+                    prompt = self.chain.prompt.format(
+                        question=question, chat_history=self.memory_manager.get_conversation_context()
+                    )
+
+                for chunk in self.llm_manager.llm.stream(prompt):
+                    text = getattr(chunk, "content", chunk)
+                    if text:
+                        parts.append(text)
+                        yield text
+                result = {"answer": "".join(parts), "source_documents": source_docs}
+                self._cache_answer(cache_key, result)
+
+            final_response.update(self._build_response(question, subject_filter, result))
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            if parts:
+                # The student already saw part of the answer; record that rather than append a fallback
+                final_response.update(self._build_response(
+                    question, subject_filter, {"answer": "".join(parts), "source_documents": source_docs}
+                ))
+                final_response["error"] = str(e)
+                return
+            fallback_answer = self.llm_manager.generate_response(question)
+            final_response.update(self._fallback_response(fallback_answer, 0.3))
+            yield fallback_answer
+
+    def _condense_question(self, inputs: Dict[str, Any]) -> str:
+        """Rewrite a follow-up into a standalone question, as the chain does before retrieval"""
+        chat_history = inputs["chat_history"]
+        if not chat_history:
+            return inputs["question"]
+        return self.chain.question_generator.predict(
+            question=inputs["question"], chat_history=get_buffer_string(chat_history)
+        )
+
+    async def _acondense_question(self, inputs: Dict[str, Any]) -> str:
+        """Async _condense_question whose LLM call can join a local generation batch"""
+        chat_history = inputs["chat_history"]
+        if not chat_history:
+            return inputs["question"]
+        prompt = self.chain.question_generator.prompt.format(
+            question=inputs["question"], chat_history=get_buffer_string(chat_history)
+        )
+        return (await self.llm_manager.agenerate(prompt)).strip()
+
+    def _answer_prompt(self, question: str, source_docs: List[Document]) -> str:
+        """Fill the chain's combine-docs prompt, as its stuff chain does, with the given question"""
+        return self._prompt_template.format(
+            context="\n\n".join(doc.page_content for doc in source_docs),
+            question=question,
+        )
+
+    async def aquery(self, question: str, subject_filter: Optional[str] = None) -> Dict[str, Any]:
+        """Process a student query without blocking on the LLM round trip"""
+        try:
+            cache_key = self._answer_cache_key(question, subject_filter)
+            result = self._answer_cache.get(cache_key)
+            if result is None:
+                # Run the chain's steps here so every LLM call goes through LLMManager.agenerate,
+                # where concurrent local-pipeline prompts share one batched forward pass
+                if isinstance(self.chain, ConversationalRetrievalChain):
+                    inputs = self._build_chain_inputs(question)
+                    standalone_question = await self._acondense_question(inputs)
+                    source_docs = await self.chain.retriever.ainvoke(standalone_question)
+                    answer = await self.llm_manager.agenerate(self._answer_prompt(standalone_question, source_docs))
+                    result = {"answer": answer, "source_documents": source_docs}
+                else:
+                    prompt = self.chain.prompt.format(
+                        question=question, chat_history=self.memory_manager.get_conversation_context()
+                    )
+                    result = {"answer": await self.llm_manager.agenerate(prompt), "source_documents": []}
+                self._cache_answer(cache_key, result)
+
+            return self._build_response(question, subject_filter, result)
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            try:
+                fallback_answer = await self.llm_manager.agenerate_response(question)
+                return self._fallback_response(fallback_answer, 0.3)
+            except Exception as inner_e:
+                logger.error(f"Fallback generation failed: {str(inner_e)}")
+                return self._fallback_response(
+                    "I apologize, but I'm having trouble processing your question right now. Could you please try rephrasing it?",
+                    0.0,
+                )
+
+    async def batch_query(
+        self, questions: List[str], subject_filter: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Process several student queries concurrently; remote round trips overlap and local prompts batch"""
+        return list(await asyncio.gather(*[self.aquery(q, subject_filter) for q in questions]))
+
+    def _answer_from_embedding(self, question: str, embedding: List[float]) -> Dict[str, Any]:
+        """Answer a standalone question from documents retrieved with a precomputed embedding"""
+        k = self.chain.retriever.search_kwargs.get("k", 4)
+        source_docs = self.vector_store_manager.similarity_search_by_vector(embedding, k=k)
+        inputs = self._build_chain_inputs(question)
+        answer = self.chain.combine_docs_chain.run(input_documents=source_docs, question=inputs["question"])
+        return {"answer": answer, "source_documents": source_docs}
+
+    def _answer_cache_key(self, question: str, subject_filter: Optional[str]) -> bytes:
+        """Hash what the answer depends on: question, filter, stable profile fields, history and index version"""
+        profile = self.memory_manager.student_profile
+        # Session count and timestamps change every turn, so only the teaching preferences go in
+        profile_key = "|".join((
+            profile.get("learning_style", ""),
+            profile.get("difficulty_preference", ""),
+            ",".join(sorted(profile.get("subjects_of_interest", ()))),
+        ))
+        history_key = get_buffer_string(self.memory_manager.get_chat_history())
+        normalized_question = " ".join(question.lower().split())
+        key_text = "\x1f".join((
+            normalized_question,
+            subject_filter or "",
+            profile_key,
+            history_key,
+            str(self.vector_store_manager.vector_store_version),
+        ))
+        return hashlib.blake2b(key_text.encode("utf-8"), digest_size=16).digest()
+
+    def _cache_answer(self, cache_key: bytes, result: Dict[str, Any]) -> None:
+        """Store the answer and sources of a chain result for repeat questions"""
+        if result.get("answer"):
+            self._answer_cache.put(cache_key, {
+                "answer": result["answer"],
+                "source_documents": result.get("source_documents", []),
+            })
+
+    def clear_answer_cache(self) -> None:
+        """Drop all cached answers, e.g. after the curriculum changes"""
+        self._answer_cache.clear()
+
+    def _build_chain_inputs(self, question: str) -> Dict[str, Any]:
+        """Compose ConversationalRetrievalChain inputs with student context and chat history"""
+        # The chain has no memory, so this bounded window is the history it condenses against
+        student_context = self.memory_manager.get_personalized_context()
+        chat_history = self.memory_manager.get_chat_history()
+        composed_question = f"STUDENT CONTEXT: {student_context}\n\nQUESTION: {question}"
+        return {
+            "question": composed_question,
+            "chat_history": chat_history,
+        }
+
+    def _build_response(
+        self, question: str, subject_filter: Optional[str], result: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Record the interaction in memory and format the chain result for the caller"""
+        # Extract response and sources
+        answer = result.get("answer", "I'm sorry, I couldn't generate a response.")
+        source_docs = result.get("source_documents", [])
+
+        # Add interaction to memory
+        metadata = {
+            "subject": subject_filter,
+            "num_sources": len(source_docs),
+            "sources": [doc.metadata.get("source_file", "unknown") for doc in source_docs],
+        }
+        self.memory_manager.add_interaction(question, answer, metadata)
+
+        response = {
+            "answer": answer,
+            "sources": self._format_sources(source_docs),
+            "student_profile": self.memory_manager.get_student_profile_summary(),
+            "confidence": self._calculate_confidence(source_docs),
+        }
+
+        logger.info(f"Processed query successfully with {len(source_docs)} sources")
+        return response
+
+    def _fallback_response(self, answer: str, confidence: float) -> Dict[str, Any]:
+        """Build a response that carries no retrieved sources"""
+        return {
+            "answer": answer,
+            "sources": [],
+            "student_profile": self.memory_manager.get_student_profile_summary(),
+            "confidence": confidence,
+        }
 
     def _format_sources(self, source_docs: List[Document]) -> List[Dict[str, Any]]:
         """Format source documents for display"""
+        rows = self.vector_store_manager.get_metadata_rows(source_docs)
+        if rows is not None:
+            # Gather precomputed previews and metadata from the vector store's SoA cache
+            soa = self.vector_store_manager.doc_meta_soa
+            return [
+                {
+                    "id": i + 1,
+                    "content": soa["previews"][row],
+                    "metadata": {
+                        "source_file": soa["source_files"][row],
+                        "subject": soa["subjects"][row],
+                        "topic": soa["topics"][row],
+                    },
+                }
+                for i, row in enumerate(rows)
+            ]
+
+        _get = dict.get
         formatted_sources = []
         for i, doc in enumerate(source_docs):
-            content = doc.page_content
-            preview = (content[:200] + "...") if len(content) > 200 else content
+            md = doc.metadata
             formatted_sources.append(
                 {
                     "id": i + 1,
-                    "content": preview,
+                    "content": _get(md, "preview") or make_preview(doc.page_content),
                     "metadata": {
-                        "source_file": doc.metadata.get("source_file", "Unknown"),
-                        "subject": doc.metadata.get("subject", "General"),
-                        "topic": doc.metadata.get("topic", "N/A"),
+                        "source_file": _get(md, "source_file", "Unknown"),
+                        "subject": _get(md, "subject", "General"),
+                        "topic": _get(md, "topic", "N/A"),
                     },
                 }
             )
@@ -204,39 +500,32 @@ Respond as Riya would - warm, educational, and focused on the student's learning
         if not source_docs:
             return 0.3  # Low confidence without sources
 
-        # Simple confidence calculation based on number and quality of sources
-        base_confidence = min(0.9, 0.5 + (len(source_docs) * 0.1))
-
-        quality_bonus = 0.0
-        for doc in source_docs:
-            if doc.metadata.get("file_type") == "pdf":
-                quality_bonus += 0.05
-            if doc.metadata.get("subject") != "general":
-                quality_bonus += 0.05
+        rows = self.vector_store_manager.get_metadata_rows(source_docs)
+        if rows is not None:
+            soa = self.vector_store_manager.doc_meta_soa
+            is_pdf = soa["is_pdf"][rows]
+            has_subject = soa["has_subject"][rows]
+        else:
+            _get = dict.get
+            metadatas = [doc.metadata for doc in source_docs]
+            n = len(metadatas)
+            is_pdf = np.fromiter((_get(md, "file_type") == "pdf" for md in metadatas), dtype=np.bool_, count=n)
+            has_subject = np.fromiter((_get(md, "subject") != "general" for md in metadatas), dtype=np.bool_, count=n)
 
-        return min(1.0, base_confidence + quality_bonus)
+        return float(_confidence_kernel(is_pdf, has_subject))
 
     def get_subject_suggestions(self, query: str) -> List[str]:
         """Get subject suggestions based on query"""
         try:
-            query_lower = query.lower()
-            subjects = []
-            subject_keywords = {
-                "mathematics": ["math", "algebra", "geometry", "calculus", "equation", "solve", "calculate"],
-                "science": ["science", "physics", "chemistry", "biology", "experiment", "theory"],
-                "english": ["english", "literature", "writing", "grammar", "essay", "reading"],
-                "history": ["history", "historical", "past", "ancient", "war", "civilization"],
-                "computer": ["computer", "programming", "code", "algorithm", "software"],
-            }
-            for subject, keywords in subject_keywords.items():
-                if any(keyword in query_lower for keyword in keywords):
-                    subjects.append(subject)
-            return subjects if subjects else ["general"]
+            return match_subjects(query) or ["general"]
         except Exception as e:
             logger.error(f"Error getting subject suggestions: {str(e)}")
             return ["general"]
 
-    def update_retriever_settings(self, k: int = 4, score_threshold: float = 0.5):
+    def update_retriever_settings(
+        self, k: int = 4, score_threshold: float = 0.5, ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+    ):
         """Update retriever settings"""
         try:
             if hasattr(self.chain, "retriever"):
@@ -244,6 +533,8 @@ Respond as Riya would - warm, educational, and focused on the student's learning
                     "k": k,
                     "score_threshold": score_threshold,
                 }
+            if ef_search is not None or nprobe is not None:
+                self.vector_store_manager.set_search_params(ef_search=ef_search, nprobe=nprobe)
             logger.info(f"Updated retriever settings: k={k}, threshold={score_threshold}")
         except Exception as e:
             logger.error(f"Error updating retriever settings: {str(e)}")
@@ -3,16 +3,15 @@ Main AI Tutor System that orchestrates all components
 """
 
 import os
+import asyncio
+import time
 import logging
-from typing import Dict, Any, List, Optional
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional
 from datetime import datetime
 
 from config import Config
-from utils.document_processor import DocumentProcessor
-from utils.vector_store import VectorStoreManager
-from utils.conversation_memory import ConversationMemoryManager
-from ai_tutor.llm_manager import LLMManager
-from ai_tutor.rag_pipeline import RAGPipeline
 
 # Configure logging
 logging.basicConfig(
@@ -21,6 +20,40 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Suggestion sets per subject, built once instead of per call
+_SUBJECT_SUGGESTIONS = {
+    "mathematics": (
+        "Would you like to practice solving equations?",
+        "Let's explore some real-world math applications!",
+        "How about we work through some step-by-step examples?",
+    ),
+    "science": (
+        "Want to learn about scientific experiments?",
+        "Let's explore how science applies to everyday life!",
+        "Would you like to understand the theory behind this concept?",
+    ),
+    "english": (
+        "Let's practice reading comprehension together!",
+        "Would you like help with writing techniques?",
+        "How about we analyze some interesting texts?",
+    ),
+}
+_DEFAULT_SUGGESTIONS = (
+    "Let's break this topic down into smaller parts!",
+    "Would you like to see some examples?",
+    "How about we explore this concept step by step?",
+)
+
+
+def _iter_curriculum_files(path: str):
+    """Recursively yield curriculum file paths using cached scandir entry types"""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _iter_curriculum_files(entry.path)
+            elif entry.name.lower().endswith((".pdf", ".txt")):
+                yield entry.path
+
 
 class EduSmartAITutor:
     """Main AI Tutor System"""
@@ -33,55 +66,53 @@ class EduSmartAITutor:
         self.memory_manager = None
         self.llm_manager = None
         self.rag_pipeline = None
+        self.answer_cache = None
         self.current_session_id = None
-        self.system_stats = {
-            "total_queries": 0,
-            "successful_responses": 0,
-            "failed_responses": 0,
-            "documents_loaded": 0,
-        }
-
-    def initialize(self) -> bool:
-        """Initialize the AI tutor system"""
+        # Suggestions depend only on the query text, so repeat queries become dict lookups
+        self._suggestions_for = lru_cache(maxsize=512)(self._compute_suggestions)
+        self.system_stats = Counter(
+            total_queries=0,
+            successful_responses=0,
+            failed_responses=0,
+            documents_loaded=0,
+        )
+
+    def initialize(self, shared: Optional["EduSmartAITutor"] = None) -> bool:
+        """Initialize the AI tutor system, reusing heavy components from ``shared`` if given"""
         try:
-            logger.info("Initializing EduSmart AI Tutor System...")
+            # Heavy dependencies (torch, faiss, langchain) load here rather than at import,
+            # so callers such as the Streamlit UI can render before they are ready
+            from utils.conversation_memory import ConversationMemoryManager
+            from ai_tutor.rag_pipeline import RAGPipeline
 
-            # Document Processor
-            self.document_processor = DocumentProcessor(
-                chunk_size=self.config.CHUNK_SIZE,
-                chunk_overlap=self.config.CHUNK_OVERLAP,
-            )
-            logger.info("Document processor initialized")
+            logger.info("Initializing EduSmart AI Tutor System...")
 
-            # Vector Store Manager
-            self.vector_store_manager = VectorStoreManager(
-                embedding_model=self.config.EMBEDDING_MODEL
-            )
-            logger.info("Vector store manager initialized")
+            if shared is not None and shared.is_initialized:
+                self.document_processor = shared.document_processor
+                self.vector_store_manager = shared.vector_store_manager
+                self.llm_manager = shared.llm_manager
+                self.answer_cache = shared.answer_cache
+                self.system_stats["documents_loaded"] = shared.system_stats["documents_loaded"]
+                logger.info("Reusing shared tutor components")
+            else:
+                self._initialize_shared_components()
 
             # Conversation Memory
+            # Old turns are summarized by a small dedicated model; without one, memory is a plain window
+            summarizer_llm = self.llm_manager.get_summarizer_llm(self.config.SUMMARIZER_MODEL)
             self.memory_manager = ConversationMemoryManager(
-                max_history=self.config.MAX_CONVERSATION_HISTORY
+                max_history=self.config.MAX_CONVERSATION_HISTORY,
+                summarizer_llm=summarizer_llm,
+                summary_max_tokens=self.config.CONVERSATION_SUMMARY_MAX_TOKENS,
             )
             logger.info("Conversation memory initialized")
 
-            # LLM Manager
-            self.llm_manager = LLMManager(
-                model_name=self.config.LLM_MODEL,
-                gemini_api_key=self.config.GEMINI_API_KEY,
-                huggingface_api_token=self.config.HUGGINGFACE_API_TOKEN,
-                use_local=False,
-            )
-            logger.info("LLM manager initialized")
-
-            # Load or create vector store
-            self._setup_vector_store()
-
             # RAG Pipeline
             self.rag_pipeline = RAGPipeline(
                 vector_store_manager=self.vector_store_manager,
                 llm_manager=self.llm_manager,
                 memory_manager=self.memory_manager,
+                answer_cache=self.answer_cache,
             )
             logger.info("RAG pipeline initialized")
 
@@ -93,9 +124,55 @@ class EduSmartAITutor:
             self.is_initialized = False
             return False
 
+    def _initialize_shared_components(self):
+        """Initialize the components that can be shared between students"""
+        from utils.document_processor import DocumentProcessor
+        from utils.vector_store import VectorStoreManager
+        from ai_tutor.llm_manager import LLMManager
+        from ai_tutor.rag_pipeline import AnswerCache
+
+        # Document Processor
+        self.document_processor = DocumentProcessor(
+            chunk_size=self.config.CHUNK_SIZE,
+            chunk_overlap=self.config.CHUNK_OVERLAP,
+        )
+        logger.info("Document processor initialized")
+
+        # Vector Store Manager
+        self.vector_store_manager = VectorStoreManager(
+            embedding_model=self.config.EMBEDDING_MODEL,
+            quantization=self.config.VECTOR_QUANTIZATION,
+            index_type=self.config.VECTOR_INDEX_TYPE,
+            hnsw_ef_search=self.config.HNSW_EF_SEARCH,
+            ivf_nprobe=self.config.IVF_NPROBE,
+            embedding_backend=self.config.EMBEDDING_BACKEND,
+            mmap_index=self.config.VECTOR_STORE_MMAP,
+        )
+        logger.info("Vector store manager initialized")
+
+        # LLM Manager
+        self.llm_manager = LLMManager(
+            model_name=self.config.LLM_MODEL,
+            gemini_api_key=self.config.GEMINI_API_KEY,
+            huggingface_api_token=self.config.HUGGINGFACE_API_TOKEN,
+            use_local=False,
+        )
+        logger.info("LLM manager initialized")
+
+        # Answers are keyed on the question, profile and history, so students can share hits
+        self.answer_cache = AnswerCache()
+
+        # Load or create vector store
+        self._setup_vector_store()
+
     def _setup_vector_store(self):
         """Setup vector store with curriculum data"""
         try:
+            import faiss
+
+            # Let FAISS's OpenMP kernels use every core for index build and search
+            faiss.omp_set_num_threads(os.cpu_count() or 1)
+
             vector_store_path = self.config.VECTOR_STORE_PATH
             if os.path.exists(vector_store_path):
                 logger.info("Loading existing vector store...")
@@ -129,11 +206,7 @@ class EduSmartAITutor:
                 logger.info(f"Curriculum directory not found: {curriculum_path}")
                 return []
 
-            file_paths = []
-            for root, dirs, files in os.walk(curriculum_path):
-                for file in files:
-                    if file.lower().endswith((".pdf", ".txt")):
-                        file_paths.append(os.path.join(root, file))
+            file_paths = list(_iter_curriculum_files(curriculum_path))
 
             if not file_paths:
                 logger.info("No curriculum files found")
@@ -150,7 +223,7 @@ class EduSmartAITutor:
         """Start a new learning session"""
         try:
             if not session_id:
-                session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                session_id = f"session_{time.time_ns():x}"
             self.current_session_id = session_id
             if self.memory_manager:
                 self.memory_manager.clear_memory()
@@ -163,18 +236,31 @@ class EduSmartAITutor:
     def end_session(self, save_session: bool = True) -> bool:
         """End the current learning session"""
         try:
-            if save_session and self.memory_manager and self.current_session_id:
+            if not self.current_session_id:
+                return True
+
+            session_log = self._session_log_path()
+            if save_session and self.memory_manager:
+                # The turn log already holds the history; the snapshot only adds the profile
                 session_file = f"sessions/{self.current_session_id}.json"
                 os.makedirs("sessions", exist_ok=True)
-                self.memory_manager.save_session(session_file)
+                self.memory_manager.save_session(session_file, include_history=False)
                 logger.info(f"Session saved: {session_file}")
-                self.current_session_id = None
+            elif os.path.exists(session_log):
+                os.remove(session_log)
+            # Either way the session is over, so later turns must not log to it
+            self.current_session_id = None
             return True
         except Exception as e:
             logger.error(f"Error ending session: {str(e)}")
             return False
 
-    def chat(self, message: str, subject_filter: Optional[str] = None) -> Dict[str, Any]:
+    def chat(
+        self,
+        message: str,
+        subject_filter: Optional[str] = None,
+        precomputed_embedding: Optional[List[float]] = None,
+    ) -> Dict[str, Any]:
         """Process a chat message from the student"""
         try:
             if not self.is_initialized:
@@ -186,20 +272,16 @@ class EduSmartAITutor:
                     "error": "System not initialized",
                 }
 
-            self.system_stats["total_queries"] += 1
-            response = self.rag_pipeline.query(message, subject_filter)
-
-            if response.get("answer"):
-                self.system_stats["successful_responses"] += 1
-            else:
-                self.system_stats["failed_responses"] += 1
+            response = self.rag_pipeline.query(message, subject_filter, precomputed_embedding)
+            self._record_outcomes([response])
 
             response["session_id"] = self.current_session_id
             response["query_count"] = self.system_stats["total_queries"]
+            self._log_turn(message, response)
             return response
         except Exception as e:
             logger.error(f"Error processing chat message: {str(e)}")
-            self.system_stats["failed_responses"] += 1
+            self.system_stats.update(total_queries=1, failed_responses=1)
             return {
                 "answer": "I apologize, but I encountered an error while processing your question. Please try rephrasing it or ask something else.",
                 "sources": [],
@@ -208,6 +290,82 @@ class EduSmartAITutor:
                 "error": str(e),
             }
 
+    def chat_stream(
+        self,
+        message: str,
+        subject_filter: Optional[str] = None,
+        final_response: Optional[Dict[str, Any]] = None,
+    ) -> Iterator[str]:
+        """Stream a chat answer; ``final_response`` receives the full response once done"""
+        final_response = final_response if final_response is not None else {}
+        if not self.is_initialized:
+            final_response.update(self.chat(message, subject_filter))
+            yield final_response["answer"]
+            return
+
+        yield from self.rag_pipeline.query_stream(message, subject_filter, final_response)
+        self._record_outcomes([final_response])
+        final_response["session_id"] = self.current_session_id
+        final_response["query_count"] = self.system_stats["total_queries"]
+        self._log_turn(message, final_response)
+
+    def _record_outcomes(self, responses: List[Dict[str, Any]]):
+        """Count answered and failed queries with a single Counter update"""
+        # A stream cut off mid-answer keeps its partial text but carries an "error" and counts as failed
+        answered = sum(1 for response in responses if response.get("answer") and "error" not in response)
+        self.system_stats.update(
+            total_queries=len(responses),
+            successful_responses=answered,
+            failed_responses=len(responses) - answered,
+        )
+
+    @property
+    def success_rate(self) -> float:
+        """Percentage of queries that produced an answer, computed only when asked for"""
+        return self.system_stats["successful_responses"] / max(1, self.system_stats["total_queries"]) * 100
+
+    def _session_log_path(self) -> str:
+        """Path of the append-only JSONL turn log for the current session"""
+        # Sits next to the sessions/<id>.json snapshot, where load_session looks for it
+        return f"sessions/{self.current_session_id}.jsonl"
+
+    def _log_turn(self, message: str, response: Dict[str, Any]):
+        """Append one chat turn to the session log so saving never rewrites the history"""
+        if not self.current_session_id or not self.memory_manager:
+            return
+        # Same shape as a conversation_history entry so load_session can replay the log directly
+        self.memory_manager.append_turn(
+            self._session_log_path(),
+            {
+                "timestamp": datetime.now().isoformat(),
+                "human_input": message,
+                "ai_response": response.get("answer", ""),
+                "metadata": {
+                    "confidence": response.get("confidence", 0.0),
+                    "num_sources": len(response.get("sources", [])),
+                },
+            },
+        )
+
+    def batch_chat(self, messages: List[str], subject_filter: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Process several chat messages concurrently through the async RAG path"""
+        try:
+            if not self.is_initialized:
+                return [self.chat(message, subject_filter) for message in messages]
+
+            responses = asyncio.run(self.rag_pipeline.batch_query(messages, subject_filter))
+            self._record_outcomes(responses)
+
+            for response in responses:
+                response["session_id"] = self.current_session_id
+                response["query_count"] = self.system_stats["total_queries"]
+            for message, response in zip(messages, responses):
+                self._log_turn(message, response)
+            return responses
+        except Exception as e:
+            logger.error(f"Error processing batch chat messages: {str(e)}")
+            return [self.chat(message, subject_filter) for message in messages]
+
     def get_system_status(self) -> Dict[str, Any]:
         """Get system status and statistics"""
         return {
@@ -237,8 +395,11 @@ class EduSmartAITutor:
                 return False
 
             chunks = self.document_processor.split_documents(documents)
-            self.vector_store_manager.add_documents(chunks)
+            if not self.vector_store_manager.add_documents(chunks):
+                logger.warning("No document chunks to add")
+                return False
             self.vector_store_manager.save_vector_store(self.config.VECTOR_STORE_PATH)
+            self.rag_pipeline.clear_answer_cache()
             self.system_stats["documents_loaded"] += len(chunks)
             logger.info(f"Added {len(chunks)} new document chunks")
             return True
@@ -252,42 +413,17 @@ class EduSmartAITutor:
             if not self.rag_pipeline:
                 return ["Let's start with the basics of your topic of interest!"]
 
-            subjects = self.rag_pipeline.get_subject_suggestions(student_query)
-            suggestions = []
-            for subject in subjects:
-                if subject == "mathematics":
-                    suggestions.extend(
-                        [
-                            "Would you like to practice solving equations?",
-                            "Let's explore some real-world math applications!",
-                            "How about we work through some step-by-step examples?",
-                        ]
-                    )
-                elif subject == "science":
-                    suggestions.extend(
-                        [
-                            "Want to learn about scientific experiments?",
-                            "Let's explore how science applies to everyday life!",
-                            "Would you like to understand the theory behind this concept?",
-                        ]
-                    )
-                elif subject == "english":
-                    suggestions.extend(
-                        [
-                            "Let's practice reading comprehension together!",
-                            "Would you like help with writing techniques?",
-                            "How about we analyze some interesting texts?",
-                        ]
-                    )
-                else:
-                    suggestions.extend(
-                        [
-                            "Let's break this topic down into smaller parts!",
-                            "Would you like to see some examples?",
-                            "How about we explore this concept step by step?",
-                        ]
-                    )
-            return suggestions[:3]
+            return list(self._suggestions_for(student_query.lower()))
         except Exception as e:
             logger.error(f"Error getting learning suggestions: {str(e)}")
             return ["I'm here to help you learn! What would you like to explore?"]
+
+    def _compute_suggestions(self, query_lower: str) -> tuple:
+        """Build the learning suggestions for a lowercased query"""
+        subjects = self.rag_pipeline.get_subject_suggestions(query_lower)
+        suggestions = []
+        for subject in subjects:
+            suggestions.extend(_SUBJECT_SUGGESTIONS.get(subject, _DEFAULT_SUGGESTIONS))
+            if len(suggestions) >= 3:
+                break
+        return tuple(suggestions[:3])
@@ -16,6 +16,8 @@ class Config:
     
     # Model Configuration
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+    # "onnx" runs CPU embedding through ONNX Runtime (needs optimum[onnxruntime]); GPUs always use torch FP16
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
     # Use Gemini as primary model for this run (can override via .env)
     LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
     
@@ -23,10 +25,23 @@ class Config:
     VECTOR_STORE_TYPE = os.getenv("VECTOR_STORE_TYPE", "faiss")
     CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
     CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+    # FAISS vector encoding: "int8" (scalar quantized) or "none" (full fp32)
+    VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "int8")
+    # FAISS index structure: "hnsw" (graph, sub-linear search), "ivfpq" (inverted lists over
+    # product-quantized codes, for large corpora) or "flat" (exhaustive scan)
+    VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+    # Memory-map the inverted lists of a saved IVF index on load instead of reading them into RAM
+    VECTOR_STORE_MMAP = os.getenv("VECTOR_STORE_MMAP", "true").lower() == "true"
     
     # App Configuration
     APP_TITLE = os.getenv("APP_TITLE", "EduSmart AI Tutor")
     MAX_CONVERSATION_HISTORY = int(os.getenv("MAX_CONVERSATION_HISTORY", "10"))
+    # Token budget of verbatim turns kept before older ones are summarized
+    CONVERSATION_SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "512"))
+    # Small, cheap model that writes the running conversation summary
+    SUMMARIZER_MODEL = os.getenv("SUMMARIZER_MODEL", "gemini-1.5-flash-8b")
     
     # File Paths
     VECTOR_STORE_PATH = "vector_store"
@@ -5,7 +5,8 @@ import streamlit as st
 import os
 import sys
 import logging
-from datetime import datetime
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Dict, Any, List
 
 # Add the current directory to Python path
@@ -18,6 +19,14 @@ from ai_tutor.tutor_system import EduSmartAITutor
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SAMPLE_QUESTIONS = [
+    "Explain algebra basics",
+    "How do forces work?",
+    "Help with reading comprehension",
+    "What is photosynthesis?",
+    "Solve: 2x + 5 = 15"
+]
+
 # Page configuration
 st.set_page_config(
     page_title=Config.PAGE_TITLE,
@@ -103,13 +112,53 @@ def initialize_session_state():
     if 'selected_subject' not in st.session_state:
         st.session_state.selected_subject = "All Subjects"
 
+def _build_shared_tutor() -> EduSmartAITutor:
+    """Build the embedding model, vector store and LLM"""
+    tutor = EduSmartAITutor()
+    if not tutor.initialize():
+        raise RuntimeError("Failed to initialize shared AI Tutor components")
+    return tutor
+
+@st.cache_resource(show_spinner=False)
+def start_tutor_preload() -> Future:
+    """Start loading the shared tutor in a background thread while the welcome screen renders"""
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tutor-preload")
+    future = executor.submit(_build_shared_tutor)
+    executor.shutdown(wait=False)
+    return future
+
+def get_shared_tutor() -> EduSmartAITutor:
+    """Wait for the background preload and share its components across reruns and users"""
+    try:
+        return start_tutor_preload().result()
+    except Exception:
+        # Drop the failed preload so the next rerun retries instead of reusing the error
+        start_tutor_preload.clear()
+        raise
+
+@st.cache_resource(show_spinner=False)
+def embed_sample_questions() -> Dict[str, List[float]]:
+    """Embed the fixed sample questions once so their buttons skip the encoder"""
+    vector_store_manager = get_shared_tutor().vector_store_manager
+    return dict(zip(SAMPLE_QUESTIONS, vector_store_manager.embed_batch(SAMPLE_QUESTIONS)))
+
+def get_sample_question_embeddings() -> Dict[str, List[float]]:
+    """Cached sample question embeddings, or none for this rerun if embedding fails"""
+    try:
+        return embed_sample_questions()
+    except Exception as e:
+        # Exceptions are not cached, so the next rerun embeds again instead of keeping {} forever
+        logger.error(f"Error embedding sample questions: {str(e)}")
+        return {}
+
 def initialize_tutor_system():
     """Initialize the AI tutor system"""
     if not st.session_state.system_initialized:
         with st.spinner("🚀 Initializing EduSmart AI Tutor... This may take a few moments."):
             try:
+                # Per-student memory and session live in this tutor; heavy components are shared
                 st.session_state.tutor_system = EduSmartAITutor()
-                success = st.session_state.tutor_system.initialize()
+                success = st.session_state.tutor_system.initialize(shared=get_shared_tutor())
                 
                 if success:
                     st.session_state.system_initialized = True
@@ -178,7 +227,7 @@ def display_sidebar():
         if st.session_state.system_initialized and st.session_state.tutor_system:
             st.header("🔧 System Status")
             status = st.session_state.tutor_system.get_system_status()
-            success_rate = (status['stats']['successful_responses'] / max(1, status['stats']['total_queries']) * 100)
+            success_rate = st.session_state.tutor_system.success_rate
             
             st.markdown(f"""
             <div class="system-status">
@@ -189,95 +238,97 @@ def display_sidebar():
             </div>
             """, unsafe_allow_html=True)
 
+def render_message_html(message: Dict[str, Any], show_sources: bool) -> str:
+    """Render one chat message, with its sources and profile as collapsible sections"""
+    if message['type'] == 'user':
+        return f"""<div class="chat-message user-message">
+<strong>🧑‍🎓 You:</strong><br>
+{message['content']}
+</div>"""
+    
+    confidence = message.get('confidence', 0.5)
+    confidence_class = 'confidence-high' if confidence > 0.7 else 'confidence-medium' if confidence > 0.4 else 'confidence-low'
+    
+    parts = [f"""<div class="chat-message ai-message">
+<strong>🤖 Riya:</strong> <span class="{confidence_class}">({confidence:.1%} confidence)</span><br>
+{message['content']}
+</div>"""]
+    
+    # Display sources if enabled
+    if show_sources and message.get('sources'):
+        source_boxes = "".join(
+            f"""<div class="source-box">
+<strong>Source {source['id']}:</strong> {source['metadata']['source_file']}<br>
+<strong>Subject:</strong> {source['metadata']['subject']}<br>
+<strong>Content:</strong> {source['content']}
+</div>"""
+            for source in message['sources']
+        )
+        parts.append(f"<details><summary>📚 Sources ({len(message['sources'])} found)</summary>{source_boxes}</details>")
+    
+    # Display student profile if available
+    if message.get('student_profile'):
+        parts.append(f"""<details><summary>👤 Your Learning Profile</summary>
+<div class="student-profile">
+{message['student_profile']}
+</div></details>""")
+    
+    return "\n".join(parts)
+
 def display_chat_interface():
     """Display the main chat interface"""
     st.header("💬 Chat with Riya Malhotra")
     
-    # Display chat history
-    chat_container = st.container()
+    # Render the whole history in a single markdown element instead of several per message
+    show_sources = st.session_state.show_sources
+    blocks = [render_message_html(message, show_sources) for message in st.session_state.chat_history]
     
+    chat_container = st.container()
     with chat_container:
-        for i, message in enumerate(st.session_state.chat_history):
-            if message['type'] == 'user':
-                st.markdown(f"""
-                <div class="chat-message user-message">
-                    <strong>🧑‍🎓 You:</strong><br>
-                    {message['content']}
-                </div>
-                """, unsafe_allow_html=True)
-            
-            elif message['type'] == 'ai':
-                confidence = message.get('confidence', 0.5)
-                confidence_class = 'confidence-high' if confidence > 0.7 else 'confidence-medium' if confidence > 0.4 else 'confidence-low'
-                
-                st.markdown(f"""
-                <div class="chat-message ai-message">
-                    <strong>🤖 Riya:</strong> <span class="{confidence_class}">({confidence:.1%} confidence)</span><br>
-                    {message['content']}
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Display sources if enabled
-                if st.session_state.show_sources and message.get('sources'):
-                    with st.expander(f"📚 Sources ({len(message['sources'])} found)"):
-                        for source in message['sources']:
-                            st.markdown(f"""
-                            <div class="source-box">
-                                <strong>Source {source['id']}:</strong> {source['metadata']['source_file']}<br>
-                                <strong>Subject:</strong> {source['metadata']['subject']}<br>
-                                <strong>Content:</strong> {source['content']}
-                            </div>
-                            """, unsafe_allow_html=True)
-                
-                # Display student profile if available
-                if message.get('student_profile'):
-                    with st.expander("👤 Your Learning Profile"):
-                        st.markdown(f"""
-                        <div class="student-profile">
-                            {message['student_profile']}
-                        </div>
-                        """, unsafe_allow_html=True)
+        st.markdown("\n".join(blocks), unsafe_allow_html=True)
 
 def handle_user_input():
     """Handle user input and generate AI response"""
     # Chat input
     user_input = st.chat_input("Ask me anything about your studies! 📚")
     
-    if user_input and st.session_state.system_initialized:
+    # The first question joins the background preload if it is still running
+    if user_input and initialize_tutor_system():
         # Add user message to history
         st.session_state.chat_history.append({
             'type': 'user',
             'content': user_input,
-            'timestamp': datetime.now()
+            'timestamp': time.time()
         })
         
         # Get subject filter
         subject_filter = None if st.session_state.selected_subject == "All Subjects" else st.session_state.selected_subject.lower()
         
-        # Generate AI response
-        with st.spinner("🤔 Riya is thinking..."):
-            try:
-                response = st.session_state.tutor_system.chat(user_input, subject_filter)
-                
-                # Add AI response to history
-                st.session_state.chat_history.append({
-                    'type': 'ai',
-                    'content': response['answer'],
-                    'sources': response.get('sources', []),
-                    'student_profile': response.get('student_profile', ''),
-                    'confidence': response.get('confidence', 0.5),
-                    'timestamp': datetime.now()
-                })
-                
-                # Show learning suggestions
-                if st.session_state.tutor_system:
-                    suggestions = st.session_state.tutor_system.get_learning_suggestions(user_input)
-                    if suggestions:
-                        st.info("💡 **Learning Suggestions:** " + " | ".join(suggestions))
-                
-            except Exception as e:
-                st.error(f"❌ Error generating response: {str(e)}")
-                logger.error(f"Response generation error: {str(e)}")
+        # Stream the AI response so the first tokens show up while the rest is generated
+        try:
+            response = {}
+            with st.chat_message("ai"):
+                st.write_stream(st.session_state.tutor_system.chat_stream(user_input, subject_filter, response))
+            
+            # Add AI response to history
+            st.session_state.chat_history.append({
+                'type': 'ai',
+                'content': response.get('answer', ''),
+                'sources': response.get('sources', []),
+                'student_profile': response.get('student_profile', ''),
+                'confidence': response.get('confidence', 0.5),
+                'timestamp': time.time()
+            })
+            
+            # Show learning suggestions
+            if st.session_state.tutor_system:
+                suggestions = st.session_state.tutor_system.get_learning_suggestions(user_input)
+                if suggestions:
+                    st.info("💡 **Learning Suggestions:** " + " | ".join(suggestions))
+            
+        except Exception as e:
+            st.error(f"❌ Error generating response: {str(e)}")
+            logger.error(f"Response generation error: {str(e)}")
         
         # Rerun to update the display
         st.rerun()
@@ -316,11 +367,14 @@ def main():
     # Initialize session state
     initialize_session_state()
     
+    # Load models in the background so the welcome screen shows up immediately
+    preload = start_tutor_preload()
+    
     # Display header
     display_header()
     
-    # Initialize tutor system
-    if not initialize_tutor_system():
+    # Initialize tutor system once the preload has finished; until then it is joined on first use
+    if preload.done() and not initialize_tutor_system():
         st.stop()
     
     # Display sidebar
@@ -343,22 +397,19 @@ def main():
         # Quick actions and tips
         st.header("🚀 Quick Actions")
         
-        sample_questions = [
-            "Explain algebra basics",
-            "How do forces work?",
-            "Help with reading comprehension",
-            "What is photosynthesis?",
-            "Solve: 2x + 5 = 15"
-        ]
+        sample_embeddings = get_sample_question_embeddings() if st.session_state.system_initialized else {}
         
         st.write("**Try these sample questions:**")
-        for question in sample_questions:
+        for question in SAMPLE_QUESTIONS:
             if st.button(f"💬 {question}", key=f"sample_{question}"):
+                if not initialize_tutor_system():
+                    st.stop()
+                
                 # Simulate user input
                 st.session_state.chat_history.append({
                     'type': 'user',
                     'content': question,
-                    'timestamp': datetime.now()
+                    'timestamp': time.time()
                 })
                 
                 # Generate response
@@ -366,7 +417,9 @@ def main():
                 
                 with st.spinner("🤔 Generating response..."):
                     try:
-                        response = st.session_state.tutor_system.chat(question, subject_filter)
+                        response = st.session_state.tutor_system.chat(
+                            question, subject_filter, precomputed_embedding=sample_embeddings.get(question)
+                        )
                         
                         st.session_state.chat_history.append({
                             'type': 'ai',
@@ -374,7 +427,7 @@ def main():
                             'sources': response.get('sources', []),
                             'student_profile': response.get('student_profile', ''),
                             'confidence': response.get('confidence', 0.5),
-                            'timestamp': datetime.now()
+                            'timestamp': time.time()
                         })
                         
                     except Exception as e:
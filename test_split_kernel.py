@@ -0,0 +1,75 @@
+"""
+Tests for the chunk boundary scanner behind DocumentProcessor.split_documents
+"""
+import sys
+import os
+
+import numpy as np
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.split_kernel import find_split_points
+
+def _codes(text):
+    """Code points of text, as split_documents passes them to the kernel"""
+    return np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+
+def _sample_text():
+    words = ["algebra", "uses", "symbols", "to", "represent", "numbers", "in", "equations"]
+    paragraphs = [" ".join(words[(i + j) % len(words)] for j in range(40 + i * 7)) for i in range(12)]
+    return "\n\n".join(paragraphs)
+
+def test_chunks_respect_chunk_size():
+    """No chunk is longer than chunk_size and the chunks cover the whole text"""
+    text = _sample_text()
+    spans = find_split_points(_codes(text), 200, 40)
+    assert len(spans) > 1
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    for start, end in spans:
+        assert 0 < end - start <= 200
+
+def test_chunks_overlap_at_word_boundaries():
+    """Consecutive chunks share at most chunk_overlap characters and restart after a separator"""
+    text = _sample_text()
+    spans = find_split_points(_codes(text), 200, 40)
+    for (_, prev_end), (start, _) in zip(spans, spans[1:]):
+        assert prev_end - 40 <= start <= prev_end
+        assert text[start - 1] in " \n"
+    assert any(start < prev_end for (_, prev_end), (start, _) in zip(spans, spans[1:]))
+
+def test_prefers_paragraph_breaks():
+    """A paragraph break in the back half of the window wins over later spaces"""
+    text = "word " * 30 + "\n\n" + "word " * 30
+    start, end = find_split_points(_codes(text), 200, 0)[0]
+    assert text[:end].endswith("\n\n")
+
+def test_empty_input():
+    """Empty text yields no chunks"""
+    spans = find_split_points(_codes(""), 200, 40)
+    assert spans.shape == (0, 2)
+
+def test_text_without_separators():
+    """Text with no breaks is cut at exactly chunk_size and still fully covered"""
+    text = "x" * 450
+    spans = find_split_points(_codes(text), 200, 40)
+    assert [tuple(span) for span in spans] == [(0, 200), (200, 400), (400, 450)]
+
+def test_lone_surrogate_keeps_offsets():
+    """A lone surrogate encodes as one code point, so offsets still slice the str correctly"""
+    text = "a\ud800b " * 100
+    codes = _codes(text)
+    assert len(codes) == len(text)
+    for start, end in find_split_points(codes, 50, 10):
+        assert len(text[start:end]) == end - start <= 50
+
+def main():
+    """Run all tests"""
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n🎯 {len(tests)}/{len(tests)} split kernel tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Tests for the subject keyword matcher behind RAGPipeline.get_subject_suggestions
+"""
+import sys
+import os
+
+# Add current directory to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from ai_tutor.rag_pipeline import _SUBJECT_MATCHER, match_subjects
+
+# Every case runs through the Aho-Corasick automaton (when installed) and the token fallback
+MATCHERS = [_SUBJECT_MATCHER, None] if _SUBJECT_MATCHER is not None else [None]
+
+def test_subject_names_match():
+    """Naming the subject is enough to classify the query"""
+    for matcher in MATCHERS:
+        assert match_subjects("Help me with mathematics", matcher) == ["mathematics"]
+        assert match_subjects("I love science", matcher) == ["science"]
+
+def test_plurals_match():
+    """Regular plurals of keywords still match"""
+    for matcher in MATCHERS:
+        assert match_subjects("Explain sorting algorithms", matcher) == ["computer"]
+        assert match_subjects("How do I solve equations?", matcher) == ["mathematics"]
+        assert match_subjects("Fun experiments for kids", matcher) == ["science"]
+
+def test_keywords_inside_words_do_not_match():
+    """A keyword in the middle of another word doesn't count"""
+    for matcher in MATCHERS:
+        assert "history" not in match_subjects("What is software?", matcher)
+        assert match_subjects("Tell me a story", matcher) == []
+
+def test_subjects_keep_table_order():
+    """Several subjects come back in SUBJECT_KEYWORDS order"""
+    for matcher in MATCHERS:
+        assert match_subjects("history of computer algebra", matcher) == ["mathematics", "history", "computer"]
+
+def main():
+    """Run all tests"""
+    tests = [value for name, value in sorted(globals().items()) if name.startswith("test_")]
+    for test in tests:
+        test()
+        print(f"✅ {test.__name__}")
+    print(f"\n🎯 {len(tests)}/{len(tests)} subject matching tests passed")
+
+if __name__ == "__main__":
+    main()
@@ -4,24 +4,27 @@ Test script for EduSmart AI Tutor system
 import sys
 import os
 import logging
+from functools import lru_cache
 
 # Add current directory to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from ai_tutor.tutor_system import EduSmartAITutor
 
+@lru_cache(maxsize=1)
+def get_tutor():
+    """Initialize one tutor and share it across tests instead of reloading models per test"""
+    tutor = EduSmartAITutor()
+    return tutor if tutor.initialize() else None
+
 def test_system_initialization():
     """Test system initialization"""
     print("🚀 Testing EduSmart AI Tutor System Initialization...")
     
     try:
-        # Initialize the tutor system
-        tutor = EduSmartAITutor()
-        print("✅ Tutor system created")
-        
-        # Initialize components
-        success = tutor.initialize()
-        if success:
+        # Initialize the shared tutor system
+        tutor = get_tutor()
+        if tutor:
             print("✅ System initialized successfully")
         else:
             print("❌ System initialization failed")
@@ -43,9 +46,8 @@ def test_basic_chat():
     print("\n💬 Testing Basic Chat Functionality...")
     
     try:
-        # Initialize system
-        tutor = EduSmartAITutor()
-        if not tutor.initialize():
+        tutor = get_tutor()
+        if not tutor:
             print("❌ Failed to initialize system for chat test")
             return False
         
@@ -87,8 +89,8 @@ def test_memory_functionality():
     print("\n🧠 Testing Memory Functionality...")
     
     try:
-        tutor = EduSmartAITutor()
-        if not tutor.initialize():
+        tutor = get_tutor()
+        if not tutor:
             print("❌ Failed to initialize system for memory test")
             return False
         
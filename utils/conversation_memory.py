@@ -1,78 +1,199 @@
 """
 Conversation memory management for personalized learning
 """
-import json
 import logging
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from langchain.memory import ConversationBufferWindowMemory
-from langchain.schema import BaseMessage, HumanMessage, AIMessage
+
+import orjson
+from langchain.memory import ConversationBufferWindowMemory, ConversationSummaryBufferMemory
+from langchain.schema import BaseMessage, HumanMessage, AIMessage, SystemMessage
 
 logger = logging.getLogger(__name__)
 
+_WORD_RE = re.compile(r"[a-z]+")
+
+# Keyword sets for profile detection, matched against message tokens
+EASY_WORDS = frozenset({'easy', 'simple', 'basic'})
+HARD_WORDS = frozenset({'hard', 'difficult', 'challenging', 'advanced'})
+VISUAL_WORDS = frozenset({'example', 'examples', 'demonstrate'})
+ANALYTICAL_WORDS = frozenset({'explain', 'why', 'how'})
+HANDS_ON_WORDS = frozenset({'practice', 'try', 'do'})
+
+# One background worker folds old turns into summaries so the summarizer call never blocks a reply
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summarizer")
+
+
+@lru_cache(maxsize=1)
+def _get_token_encoding():
+    """Load the tiktoken encoding once; None when tiktoken is unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens locally; close enough to the LLM's tokenizer for a memory budget"""
+    encoding = _get_token_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
 class ConversationMemoryManager:
     """Manages conversation memory and learning context"""
     
-    def __init__(self, max_history: int = 10):
+    def __init__(self, max_history: int = 10, summarizer_llm=None, summary_max_tokens: int = 512):
         self.max_history = max_history
-        self.memory = ConversationBufferWindowMemory(
-            k=max_history,
-            memory_key="chat_history",
-            return_messages=True,
-            output_key="answer"
-        )
+        self.summary_max_tokens = summary_max_tokens
+        # Guards the summary buffer, which the background summarizer also updates
+        self._memory_lock = threading.Lock()
+        self._buffer_tokens = 0
+        self._summary_pending = False
+        # Bumped by clear/load so a summary of discarded turns is dropped
+        self._memory_epoch = 0
+        if summarizer_llm is not None:
+            # Older turns are folded into a running summary so the prompt stays under a token budget
+            self.memory = ConversationSummaryBufferMemory(
+                llm=summarizer_llm,
+                max_token_limit=summary_max_tokens,
+                memory_key="chat_history",
+                return_messages=True,
+                output_key="answer"
+            )
+        else:
+            self.memory = ConversationBufferWindowMemory(
+                k=max_history,
+                memory_key="chat_history",
+                return_messages=True,
+                output_key="answer"
+            )
         self.student_profile = {
             'learning_style': 'adaptive',
             'difficulty_preference': 'medium',
-            'subjects_of_interest': [],
+            'subjects_of_interest': set(),
             'common_mistakes': [],
             'strengths': [],
             'session_count': 0,
             'last_session': None
         }
-        self.conversation_history = []
+        # Bounded detailed history; appending past maxlen evicts the oldest turn in O(1)
+        self.conversation_history = deque(maxlen=max_history * 2)
+        # First turn of the append-only context window; only moves on a periodic reset
+        self._window_start = 0
+        # Sliding window of recent messages, kept in step with the LangChain memory window
+        self.chat_window = deque(maxlen=max_history * 2)
     
     def add_interaction(self, human_input: str, ai_response: str, metadata: Optional[Dict] = None):
         """Add a new interaction to memory"""
         try:
-            # Add to LangChain memory
-            self.memory.chat_memory.add_user_message(human_input)
-            self.memory.chat_memory.add_ai_message(ai_response)
+            self._append_turn_messages(human_input, ai_response)
+            self._schedule_summary()
+            
+            # Read the clock once; the interaction and the profile share the timestamp
+            timestamp = datetime.now().isoformat()
             
             # Add to detailed history with metadata
             interaction = {
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': timestamp,
                 'human_input': human_input,
                 'ai_response': ai_response,
                 'metadata': metadata or {}
             }
             
+            if len(self.conversation_history) == self.conversation_history.maxlen:
+                # The append below evicts the oldest turn
+                self._window_start = max(0, self._window_start - 1)
             self.conversation_history.append(interaction)
             
-            # Keep only recent interactions
-            if len(self.conversation_history) > self.max_history * 2:
-                self.conversation_history = self.conversation_history[-self.max_history * 2:]
+            # Reset the context window once it spans 2x max_history turns, keeping the newest half
+            if len(self.conversation_history) - self._window_start >= self.max_history * 2:
+                self._window_start = len(self.conversation_history) - self.max_history
             
             # Update student profile
-            self._update_student_profile(human_input, ai_response, metadata)
+            self._update_student_profile(human_input, ai_response, metadata, timestamp)
             
             logger.info("Added interaction to conversation memory")
             
         except Exception as e:
             logger.error(f"Error adding interaction to memory: {str(e)}")
     
+    @property
+    def summarizes(self) -> bool:
+        """Whether older turns are folded into a running summary"""
+        return isinstance(self.memory, ConversationSummaryBufferMemory)
+    
+    def _append_turn_messages(self, human_input: str, ai_response: str):
+        """Write one turn to the memory buffer; summary mode counts its tokens locally"""
+        human_message = HumanMessage(content=human_input)
+        ai_message = AIMessage(content=ai_response)
+        if self.summarizes:
+            with self._memory_lock:
+                self.memory.chat_memory.add_messages([human_message, ai_message])
+                self._buffer_tokens += count_tokens(human_input) + count_tokens(ai_response)
+        else:
+            self.memory.chat_memory.add_messages([human_message, ai_message])
+            self.chat_window.append(human_message)
+            self.chat_window.append(ai_message)
+    
+    def _schedule_summary(self):
+        """Summarize turns over the token budget on the background worker"""
+        with self._memory_lock:
+            if not self.summarizes or self._summary_pending or self._buffer_tokens <= self.summary_max_tokens:
+                return
+            self._summary_pending = True
+        _SUMMARY_EXECUTOR.submit(self._summarize_overflow)
+    
+    def _summarize_overflow(self):
+        """Pop the oldest messages past the token budget and fold them into the running summary"""
+        try:
+            while True:
+                with self._memory_lock:
+                    messages = self.memory.chat_memory.messages
+                    pruned = []
+                    while messages and self._buffer_tokens > self.summary_max_tokens:
+                        message = messages.pop(0)
+                        self._buffer_tokens -= count_tokens(message.content)
+                        pruned.append(message)
+                    if not pruned:
+                        self._summary_pending = False
+                        return
+                    summary = self.memory.moving_summary_buffer
+                    epoch = self._memory_epoch
+                
+                # The remote call runs without the lock so new turns can still be recorded
+                summary = self.memory.predict_new_summary(pruned, summary)
+                with self._memory_lock:
+                    if epoch != self._memory_epoch:
+                        self._summary_pending = False
+                        return
+                    self.memory.moving_summary_buffer = summary
+        except Exception as e:
+            logger.error(f"Error summarizing conversation memory: {str(e)}")
+            with self._memory_lock:
+                self._summary_pending = False
+    
     def get_conversation_context(self) -> str:
         """Get formatted conversation context"""
         try:
             if not self.conversation_history:
                 return "This is the beginning of our conversation."
             
-            recent_interactions = self.conversation_history[-3:]  # Last 3 interactions
+            # Grow the window by appending whole turns so consecutive prompts share a byte-identical
+            # prefix that LLM-side prefix caches can reuse
             context_parts = []
             
-            for interaction in recent_interactions:
+            for interaction in islice(self.conversation_history, self._window_start, None):
                 context_parts.append(f"Student: {interaction['human_input']}")
-                context_parts.append(f"Tutor: {interaction['ai_response'][:200]}...")
+                context_parts.append(f"Tutor: {interaction['ai_response']}")
             
             return "\n".join(context_parts)
             
@@ -90,7 +211,8 @@ class ConversationMemoryManager:
             def _clean(items):
                 return [str(x) for x in items if x]
             
-            subjects = _clean(profile.get('subjects_of_interest', []))
+            # Sets iterate in hash order; sort so the summary text is stable between runs
+            subjects = sorted(_clean(profile.get('subjects_of_interest', [])))
             if subjects:
                 summary_parts.append(f"Interested in: {', '.join(subjects)}")
             
@@ -112,36 +234,36 @@ class ConversationMemoryManager:
             logger.error(f"Error getting student profile summary: {str(e)}")
             return "Profile unavailable"
     
-    def _update_student_profile(self, human_input: str, ai_response: str, metadata: Optional[Dict]):
+    def _update_student_profile(self, human_input: str, ai_response: str, metadata: Optional[Dict],
+                                timestamp: Optional[str] = None):
         """Update student profile based on interaction"""
         try:
             # Extract subject from metadata or input
             if metadata and 'subject' in metadata:
                 subject = metadata['subject']
                 if subject and isinstance(subject, str):
-                    if subject not in self.student_profile['subjects_of_interest']:
-                        self.student_profile['subjects_of_interest'].append(subject)
+                    self.student_profile['subjects_of_interest'].add(subject)
             
             # Analyze input for learning patterns
-            input_lower = human_input.lower()
+            tokens = set(_WORD_RE.findall(human_input.lower()))
             
             # Detect difficulty preferences
-            if any(word in input_lower for word in ['easy', 'simple', 'basic']):
+            if tokens & EASY_WORDS:
                 self.student_profile['difficulty_preference'] = 'easy'
-            elif any(word in input_lower for word in ['hard', 'difficult', 'challenging', 'advanced']):
+            elif tokens & HARD_WORDS:
                 self.student_profile['difficulty_preference'] = 'hard'
             
             # Detect learning style indicators
-            if any(word in input_lower for word in ['example', 'show me', 'demonstrate']):
+            if tokens & VISUAL_WORDS or {'show', 'me'} <= tokens:
                 self.student_profile['learning_style'] = 'visual'
-            elif any(word in input_lower for word in ['explain', 'why', 'how']):
+            elif tokens & ANALYTICAL_WORDS:
                 self.student_profile['learning_style'] = 'analytical'
-            elif any(word in input_lower for word in ['practice', 'try', 'do']):
+            elif tokens & HANDS_ON_WORDS:
                 self.student_profile['learning_style'] = 'hands-on'
             
             # Update session info
             self.student_profile['session_count'] += 1
-            self.student_profile['last_session'] = datetime.now().isoformat()
+            self.student_profile['last_session'] = timestamp or datetime.now().isoformat()
             
         except Exception as e:
             logger.error(f"Error updating student profile: {str(e)}")
@@ -150,52 +272,109 @@ class ConversationMemoryManager:
         """Get memory variables for use in chains"""
         return self.memory.load_memory_variables({})
     
+    def get_chat_history(self) -> List[BaseMessage]:
+        """Get the recent chat messages, led by the running summary in summary mode"""
+        if not self.summarizes:
+            return list(self.chat_window)
+        with self._memory_lock:
+            messages = list(self.memory.chat_memory.messages)
+            summary = self.memory.moving_summary_buffer
+        return [SystemMessage(content=summary)] + messages if summary else messages
+    
     def clear_memory(self):
         """Clear conversation memory"""
         try:
-            self.memory.clear()
-            self.conversation_history = []
+            self._reset_memory()
+            self.conversation_history.clear()
+            self._window_start = 0
             logger.info("Conversation memory cleared")
         except Exception as e:
             logger.error(f"Error clearing memory: {str(e)}")
     
-    def save_session(self, filepath: str):
-        """Save conversation session to file"""
+    def save_session(self, filepath: str, include_history: bool = True):
+        """Save conversation session to file
+
+        With include_history=False only the profile is written and load_session rebuilds the
+        history from the JSONL turn log next to the file.
+        """
         try:
             session_data = {
-                'student_profile': self.student_profile,
-                'conversation_history': self.conversation_history,
+                'student_profile': {
+                    **self.student_profile,
+                    'subjects_of_interest': sorted(self.student_profile['subjects_of_interest'])
+                },
                 'timestamp': datetime.now().isoformat()
             }
+            if include_history:
+                session_data['conversation_history'] = list(self.conversation_history)
             
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(session_data, f, indent=2, ensure_ascii=False)
+            # orjson writes compact UTF-8 bytes, several times faster than stdlib json
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(
+                    session_data,
+                    option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+                ))
             
             logger.info(f"Session saved to {filepath}")
             
         except Exception as e:
             logger.error(f"Error saving session: {str(e)}")
     
+    def append_turn(self, filepath: str, turn: Dict[str, Any]):
+        """Append a single interaction to a JSONL session log"""
+        try:
+            os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+            with open(filepath, 'ab') as f:
+                f.write(orjson.dumps(turn, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE))
+        except Exception as e:
+            logger.error(f"Error appending turn to {filepath}: {str(e)}")
+    
     def load_session(self, filepath: str):
         """Load conversation session from file"""
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                session_data = json.load(f)
+            with open(filepath, 'rb') as f:
+                session_data = orjson.loads(f.read())
             
             self.student_profile = session_data.get('student_profile', self.student_profile)
-            self.conversation_history = session_data.get('conversation_history', [])
-            
-            # Restore LangChain memory
-            self.memory.clear()
-            for interaction in self.conversation_history[-self.max_history:]:
-                self.memory.chat_memory.add_user_message(interaction['human_input'])
-                self.memory.chat_memory.add_ai_message(interaction['ai_response'])
+            self.student_profile['subjects_of_interest'] = set(self.student_profile.get('subjects_of_interest', ()))
+            history = session_data.get('conversation_history')
+            if history is None:
+                history = self._read_turn_log(self.turn_log_path(filepath))
+            self.conversation_history = deque(history, maxlen=self.max_history * 2)
+            self._window_start = max(0, len(self.conversation_history) - self.max_history)
+            
+            # Restore LangChain memory; over-budget turns are summarized once, in the background
+            self._reset_memory()
+            for interaction in islice(self.conversation_history, self._window_start, None):
+                self._append_turn_messages(interaction['human_input'], interaction['ai_response'])
+            self._schedule_summary()
             
             logger.info(f"Session loaded from {filepath}")
             
         except Exception as e:
             logger.error(f"Error loading session: {str(e)}")
     
+    def _reset_memory(self):
+        """Empty the LangChain memory and drop any summary still being computed"""
+        with self._memory_lock:
+            self.memory.clear()
+            self._buffer_tokens = 0
+            self._memory_epoch += 1
+        self.chat_window.clear()
+    
+    @staticmethod
+    def turn_log_path(filepath: str) -> str:
+        """Path of the JSONL turn log that belongs to a session snapshot"""
+        return os.path.splitext(filepath)[0] + '.jsonl'
+    
+    def _read_turn_log(self, filepath: str) -> deque:
+        """Read the newest turns of a JSONL session log"""
+        turns = deque(maxlen=self.max_history * 2)
+        if os.path.exists(filepath):
+            with open(filepath, 'rb') as f:
+                turns.extend(orjson.loads(line) for line in f if line.strip())
+        return turns
+    
     def get_personalized_context(self) -> str:
         """Get personalized context for the AI tutor"""
         try:
@@ -207,7 +386,7 @@ class ConversationMemoryManager:
             ]
             
             if self.student_profile['subjects_of_interest']:
-                context_parts.append(f"Interested Subjects: {', '.join(self.student_profile['subjects_of_interest'])}")
+                context_parts.append(f"Interested Subjects: {', '.join(sorted(self.student_profile['subjects_of_interest']))}")
             
             if self.student_profile['strengths']:
                 context_parts.append(f"Strengths: {', '.join(self.student_profile['strengths'])}")
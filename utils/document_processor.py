@@ -2,92 +2,171 @@
 Document processing utilities for curriculum content
 """
 import os
+import re
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List, Dict, Any
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+
 from langchain.schema import Document
 
+try:
+    import ahocorasick
+except ImportError:  # Optional: fall back to a compiled regex
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+
+# Checked in order: the first subject with a keyword in the filename wins
+FILENAME_SUBJECT_KEYWORDS: Dict[str, tuple] = {
+    'math': ('math', 'mathematics', 'algebra', 'geometry', 'calculus'),
+    'science': ('science', 'physics', 'chemistry', 'biology'),
+    'history': ('history', 'social', 'studies'),
+    'english': ('english', 'literature', 'language', 'writing'),
+    'computer': ('computer', 'programming', 'coding', 'cs')
+}
+
+
+def _build_filename_matcher():
+    """Compile every filename keyword into one Aho-Corasick automaton tagged with its subject's rank"""
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for rank, (subject, keywords) in enumerate(FILENAME_SUBJECT_KEYWORDS.items()):
+        for keyword in keywords:
+            automaton.add_word(keyword, (rank, subject))
+    automaton.make_automaton()
+    return automaton
+
+
+# Built at import so each loader worker process compiles it once
+_FILENAME_MATCHER = _build_filename_matcher()
+
+# Fallback classifier: one anchored alternation tried in subject order, each branch a lookahead
+# for that subject's keywords, so the regex engine keeps the dict's precedence in a single call
+_FILENAME_SUBJECT_RE = re.compile(
+    "^(?:" + "|".join(
+        f"(?=.*(?:{'|'.join(map(re.escape, keywords))}))(?P<{subject}>)"
+        for subject, keywords in FILENAME_SUBJECT_KEYWORDS.items()
+    ) + ")",
+    re.DOTALL
+)
+
+
+def extract_subject_from_filename(file_path: str) -> str:
+    """Extract subject from filename"""
+    filename = os.path.basename(file_path).lower()
+    
+    if _FILENAME_MATCHER is not None:
+        # Single pass over the name; the lowest rank keeps the dict's precedence
+        best = min((match for _, match in _FILENAME_MATCHER.iter(filename)), default=None)
+        return best[1] if best else 'general'
+    
+    match = _FILENAME_SUBJECT_RE.search(filename)
+    return match.lastgroup if match else 'general'
+
+
+def _load_file(file_path: str) -> List[Document]:
+    """Load a single curriculum file and tag it with source metadata"""
+    try:
+        if not os.path.exists(file_path):
+            logger.warning(f"File not found: {file_path}")
+            return []
+        
+        file_extension = os.path.splitext(file_path)[1].lower()
+        
+        # Loaders pull in pypdf and friends, so import them only for the format being read
+        if file_extension == '.pdf':
+            from langchain_community.document_loaders import PyPDFLoader
+            loader = PyPDFLoader(file_path)
+        elif file_extension == '.txt':
+            from langchain_community.document_loaders import TextLoader
+            loader = TextLoader(file_path, encoding='utf-8')
+        else:
+            logger.warning(f"Unsupported file format: {file_extension}")
+            return []
+        
+        docs = loader.load()
+        
+        # Add metadata
+        for doc in docs:
+            doc.metadata.update({
+                'source_file': os.path.basename(file_path),
+                'file_type': file_extension,
+                'subject': extract_subject_from_filename(file_path)
+            })
+        
+        logger.info(f"Loaded {len(docs)} documents from {file_path}")
+        return docs
+        
+    except Exception as e:
+        logger.error(f"Error loading {file_path}: {str(e)}")
+        return []
+
+
 class DocumentProcessor:
     """Handles document loading and processing for curriculum content"""
     
+    MAX_LOADER_THREADS = 8
+    
     def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
     
     def load_documents(self, file_paths: List[str]) -> List[Document]:
         """Load documents from various file formats"""
-        documents = []
+        if len(file_paths) <= 1:
+            return [doc for file_path in file_paths for doc in _load_file(file_path)]
         
-        for file_path in file_paths:
-            try:
-                if not os.path.exists(file_path):
-                    logger.warning(f"File not found: {file_path}")
-                    continue
-                
-                file_extension = os.path.splitext(file_path)[1].lower()
-                
-                if file_extension == '.pdf':
-                    loader = PyPDFLoader(file_path)
-                elif file_extension == '.txt':
-                    loader = TextLoader(file_path, encoding='utf-8')
-                else:
-                    logger.warning(f"Unsupported file format: {file_extension}")
-                    continue
-                
-                docs = loader.load()
-                
-                # Add metadata
-                for doc in docs:
-                    doc.metadata.update({
-                        'source_file': os.path.basename(file_path),
-                        'file_type': file_extension,
-                        'subject': self._extract_subject_from_filename(file_path)
-                    })
-                
-                documents.extend(docs)
-                logger.info(f"Loaded {len(docs)} documents from {file_path}")
-                
-            except Exception as e:
-                logger.error(f"Error loading {file_path}: {str(e)}")
+        max_workers = min(len(file_paths), os.cpu_count() or 1)
+        if not any(file_path.lower().endswith('.pdf') for file_path in file_paths):
+            # Text files are read-bound and release the GIL, so threads avoid process start-up and pickling
+            return self._load_with_threads(file_paths, max_workers)
+        
+        # PDF parsing is CPU-bound and independent per file, so spread it across cores
+        documents = []
+        try:
+            # Forking a process that already runs threads (Streamlit, torch) can deadlock the children
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                for docs in executor.map(_load_file, file_paths, chunksize=4):
+                    documents.extend(docs)
+        except Exception as e:
+            logger.error(f"Parallel document loading failed, loading with threads: {str(e)}")
+            documents = self._load_with_threads(file_paths, max_workers)
         
         return documents
     
+    def _load_with_threads(self, file_paths: List[str], max_workers: int) -> List[Document]:
+        """Load files on a thread pool, keeping the input order"""
+        with ThreadPoolExecutor(max_workers=min(max_workers, self.MAX_LOADER_THREADS)) as executor:
+            return [doc for docs in executor.map(_load_file, file_paths) for doc in docs]
+    
     def split_documents(self, documents: List[Document]) -> List[Document]:
         """Split documents into chunks"""
-        try:
-            chunks = self.text_splitter.split_documents(documents)
-            logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks")
-            return chunks
-        except Exception as e:
-            logger.error(f"Error splitting documents: {str(e)}")
-            return []
+        # numpy and the numba-compiled kernel load only when something is actually split
+        import numpy as np
+        from utils.split_kernel import find_split_points
+        
+        chunks = []
+        for doc in documents:
+            try:
+                text = doc.page_content
+                # UTF-32 gives one array element per code point, matching len(); surrogatepass
+                # keeps lone surrogates from broken PDF text extraction as single elements too
+                codes = np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+                for start, end in find_split_points(codes, self.chunk_size, self.chunk_overlap):
+                    chunk_text = text[start:end].strip()
+                    if chunk_text:
+                        chunks.append(Document(page_content=chunk_text, metadata=dict(doc.metadata)))
+            except Exception as e:
+                logger.error(f"Error splitting document {doc.metadata.get('source_file', '')}: {str(e)}")
+        logger.info(f"Split {len(documents)} documents into {len(chunks)} chunks")
+        return chunks
     
     def _extract_subject_from_filename(self, file_path: str) -> str:
         """Extract subject from filename"""
-        filename = os.path.basename(file_path).lower()
-        
-        subjects = {
-            'math': ['math', 'mathematics', 'algebra', 'geometry', 'calculus'],
-            'science': ['science', 'physics', 'chemistry', 'biology'],
-            'history': ['history', 'social', 'studies'],
-            'english': ['english', 'literature', 'language', 'writing'],
-            'computer': ['computer', 'programming', 'coding', 'cs']
-        }
-        
-        for subject, keywords in subjects.items():
-            if any(keyword in filename for keyword in keywords):
-                return subject
-        
-        return 'general'
+        return extract_subject_from_filename(file_path)
     
     def create_sample_curriculum(self) -> List[Document]:
         """Create sample curriculum content for demonstration"""
@@ -0,0 +1,64 @@
+"""
+Character-level chunk boundary scanner used by the document splitter
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # Optional: run the scanner as plain Python
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+_NEWLINE = 10
+_SPACE = 32
+
+
+@njit(cache=True)
+def _backtrack_to(codes: np.ndarray, start: int, end: int, floor: int, first: int, second: int) -> int:
+    """Latest split position in (floor, end] right after first (+ second, if non-zero), else -1"""
+    for pos in range(end, floor, -1):
+        if second:
+            if pos - 2 >= start and codes[pos - 2] == first and codes[pos - 1] == second:
+                return pos
+        elif codes[pos - 1] == first:
+            return pos
+    return -1
+
+
+@njit(cache=True)
+def find_split_points(codes: np.ndarray, chunk_size: int, chunk_overlap: int) -> np.ndarray:
+    """Return (start, end) code point offsets of chunks, preferring paragraph, line, then word breaks"""
+    n = len(codes)
+    spans = np.empty((n // max(1, chunk_size - chunk_overlap) + 2, 2), dtype=np.int64)
+    count = 0
+    start = 0
+    while start < n:
+        end = min(start + chunk_size, n)
+        if end < n:
+            # Only break in the back half of the window so chunks stay close to chunk_size
+            floor = start + chunk_size // 2
+            split = _backtrack_to(codes, start, end, floor, _NEWLINE, _NEWLINE)
+            if split < 0:
+                split = _backtrack_to(codes, start, end, floor, _NEWLINE, 0)
+            if split < 0:
+                split = _backtrack_to(codes, start, end, floor, _SPACE, 0)
+            if split > 0:
+                end = split
+        
+        if count == len(spans):
+            grown = np.empty((len(spans) * 2, 2), dtype=np.int64)
+            grown[:count] = spans[:count]
+            spans = grown
+        spans[count, 0] = start
+        spans[count, 1] = end
+        count += 1
+        if end >= n:
+            break
+        
+        # Start the next chunk chunk_overlap back, moved forward to the next word boundary
+        next_start = max(end - chunk_overlap, start + 1)
+        while next_start < end and codes[next_start - 1] != _SPACE and codes[next_start - 1] != _NEWLINE:
+            next_start += 1
+        start = next_start
+    return spans[:count]
@@ -4,33 +4,256 @@ Vector store management for RAG pipeline
 import os
 import pickle
 import logging
-from typing import List, Optional, Dict, Any
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import multiprocessing
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Dict, Any, Tuple
+import msgpack
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
 from langchain.schema import Document
 
+# faiss, the LangChain FAISS wrapper and the HuggingFace embeddings (torch, transformers) are
+# imported where they are first needed so importing this module stays cheap
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
 logger = logging.getLogger(__name__)
 
+PREVIEW_LENGTH = 200
+
+
+def make_preview(content: str) -> str:
+    """Truncate document content for source display"""
+    return (content[:PREVIEW_LENGTH] + "...") if len(content) > PREVIEW_LENGTH else content
+
+
+def _embed_shard(model_name: str, texts: List[str], batch_size: int, num_threads: int) -> np.ndarray:
+    """Worker: encode one shard of texts in its own process and return float16 vectors"""
+    import torch
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    
+    # Split the cores between workers instead of every process claiming all of them
+    torch.set_num_threads(num_threads)
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={
+            'normalize_embeddings': True,
+            'batch_size': batch_size,
+            'convert_to_numpy': True,
+            'show_progress_bar': False
+        }
+    )
+    # float16 halves the bytes pickled back to the parent
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float16)
+
+
+class DynamicBatchingEmbeddings(Embeddings):
+    """Coalesce concurrent embed_query calls into a single encoder forward pass"""
+    
+    def __init__(self, base: Embeddings, max_batch_size: int = 32, batch_window: float = 0.01,
+                 cache_size: int = 1024):
+        self.base = base
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.cache_size = cache_size
+        # LRU of query text -> float16 vector; half precision halves the cache footprint
+        self._query_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Document batches are already large; encode them directly"""
+        return self.base.embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Return a cached vector, or queue the query and wait for the batch it lands in to be encoded"""
+        with self._cache_lock:
+            cached = self._query_cache.get(text)
+            if cached is not None:
+                self._query_cache.move_to_end(text)
+                return cached.astype(np.float32).tolist()
+        
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        vector = future.result()
+        
+        with self._cache_lock:
+            self._query_cache[text] = np.asarray(vector, dtype=np.float16)
+            if len(self._query_cache) > self.cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+    
+    def _ensure_worker(self) -> None:
+        """Start the batching thread on first use"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_batches, name="embedding-batcher", daemon=True)
+                self._worker.start()
+    
+    def _run_batches(self) -> None:
+        """Collect queries for up to batch_window seconds and encode them in one call"""
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            try:
+                vectors = self.base.embed_documents([text for text, _ in batch])
+                for (_, future), vector in zip(batch, vectors):
+                    future.set_result(vector)
+            except Exception as e:
+                logger.error(f"Error embedding query batch: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class CachedRetriever(BaseRetriever):
+    """Chain retriever that routes through the manager's cached, metadata-aware search"""
+
+    manager: Any
+    search_kwargs: Dict[str, Any] = {"k": 4}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.manager.similarity_search(
+            query,
+            k=self.search_kwargs.get("k", 4),
+            filter_dict=self.search_kwargs.get("filter"),
+            score_threshold=self.search_kwargs.get("score_threshold"),
+        )
+
+
 class VectorStoreManager:
     """Manages vector store operations for document retrieval"""
     
-    def __init__(self, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"):
+    METADATA_FILE = 'metadata.msgpack'
+    LEGACY_METADATA_FILE = 'metadata.pkl'
+    EMBEDDING_BATCH_SIZE = 64
+    HNSW_M = 32
+    HNSW_EF_CONSTRUCTION = 200
+    MAX_TRAINING_POINTS = 65536  # quantizer codebooks converge well before this many samples
+    IVF_MIN_TRAINING_POINTS = 1024  # below this an IVF-PQ codebook is poorly trained
+    EXACT_FILTER_MAX_CANDIDATES = 50000  # up to this many filter matches, score their decoded rows exactly
+    PARALLEL_EMBEDDING_MIN_TEXTS = 4096  # below this, loading the model per process costs more than it saves
+    QUERY_MAX_BATCH = 32
+    QUERY_BATCH_WINDOW = 0.01  # seconds to wait for more concurrent queries before encoding
+    QUERY_CACHE_SIZE = 1024
+    
+    def __init__(self, embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2", quantization: str = "int8",
+                 index_type: str = "hnsw", hnsw_ef_search: int = 64, ivf_nprobe: int = 16,
+                 embedding_backend: str = "torch", mmap_index: bool = True):
         self.embedding_model = embedding_model
-        self.embeddings = HuggingFaceEmbeddings(
+        self.quantization = quantization
+        self.index_type = index_type
+        self.hnsw_ef_search = hnsw_ef_search
+        self.ivf_nprobe = ivf_nprobe
+        self.mmap_index = mmap_index
+        # True while the index is a read-only memory map of the saved file
+        self._index_mmapped = False
+        self._index_path = None
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        
+        self.embedding_device = self._select_embedding_device()
+        self.embedding_backend = self._select_embedding_backend(embedding_backend)
+        model_kwargs = {'device': self.embedding_device}
+        if self.embedding_backend == 'onnx':
+            # ONNX Runtime's fused CPU kernels; sentence-transformers exports and caches the graph
+            model_kwargs['backend'] = 'onnx'
+        self.base_embeddings = HuggingFaceEmbeddings(
             model_name=embedding_model,
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
+            model_kwargs=model_kwargs,
+            encode_kwargs={
+                'normalize_embeddings': True,
+                'batch_size': self.EMBEDDING_BATCH_SIZE,
+                'convert_to_numpy': True,
+                'show_progress_bar': False
+            }
+        )
+        if self.embedding_device == 'cuda':
+            # FP16 halves memory traffic of the encoder forward pass; vectors are upcast to fp32 for FAISS
+            self.base_embeddings.client.half()
+        # Every search embeds through this wrapper so repeated queries skip the encoder and concurrent ones share a forward pass
+        self.embeddings = DynamicBatchingEmbeddings(
+            self.base_embeddings, self.QUERY_MAX_BATCH, self.QUERY_BATCH_WINDOW, self.QUERY_CACHE_SIZE
         )
         self.vector_store = None
+        self.doc_meta_soa = None
+        self._meta_index = None
+        # Bumped whenever the index changes so cached search results keyed on it go stale
+        self.vector_store_version = 0
+        self._cached_search = lru_cache(maxsize=512)(self._search)
         
-    def create_vector_store(self, documents: List[Document]) -> FAISS:
+    def _select_embedding_device(self) -> str:
+        """Run the embedding model on GPU when one is available"""
+        import torch
+        
+        return 'cuda' if torch.cuda.is_available() else 'cpu'
+    
+    def _select_embedding_backend(self, requested: str) -> str:
+        """Use ONNX Runtime for CPU encoding when requested and installed"""
+        if requested != 'onnx' or self.embedding_device != 'cpu':
+            return 'torch'
+        try:
+            import onnxruntime  # noqa: F401
+            import optimum  # noqa: F401
+            return 'onnx'
+        except ImportError:
+            logger.warning("ONNX embedding backend requested but optimum/onnxruntime are not installed")
+            return 'torch'
+    
+    def create_vector_store(self, documents: List[Document]) -> "FAISS":
         """Create a new vector store from documents"""
+        from langchain_community.docstore.in_memory import InMemoryDocstore
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        
         try:
             if not documents:
                 raise ValueError("No documents provided for vector store creation")
             
             logger.info(f"Creating vector store with {len(documents)} documents")
-            self.vector_store = FAISS.from_documents(documents, self.embeddings)
+            self._attach_previews(documents)
+            
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            vectors = self._embed_texts(texts)
+            
+            index = self._build_index(vectors)
+            self._index_mmapped = False
+            self.vector_store = FAISS(
+                embedding_function=self.embeddings,
+                index=index,
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+            self._add_vectors(texts, metadatas, vectors)
+            self._build_metadata_cache()
+            self.vector_store_version += 1
             logger.info("Vector store created successfully")
             return self.vector_store
             
@@ -38,18 +261,147 @@ class VectorStoreManager:
             logger.error(f"Error creating vector store: {str(e)}")
             raise
     
-    def add_documents(self, documents: List[Document]) -> None:
-        """Add new documents to existing vector store"""
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed all texts in batched encoder calls and return a float32 matrix"""
+        # SentenceTransformer.encode already length-sorts each call so batches pad evenly
+        vectors = None
+        if self._use_parallel_embedding(len(texts)):
+            vectors = self._embed_in_processes(texts)
+        if vectors is None:
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return vectors
+    
+    def _add_vectors(self, texts: List[str], metadatas: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+        """Add the float32 matrix straight to the index and register its documents"""
+        # add_embeddings would round-trip the matrix through Python lists before FAISS copies it back
+        start = self.vector_store.index.ntotal
+        doc_ids = [str(uuid.uuid4()) for _ in texts]
+        self.vector_store.index.add(vectors)
+        self.vector_store.docstore.add({
+            doc_id: Document(page_content=text, metadata=metadata, id=doc_id)
+            for doc_id, text, metadata in zip(doc_ids, texts, metadatas)
+        })
+        self.vector_store.index_to_docstore_id.update(
+            (start + offset, doc_id) for offset, doc_id in enumerate(doc_ids)
+        )
+    
+    def _use_parallel_embedding(self, num_texts: int) -> bool:
+        """Shard across processes only for large CPU builds on the torch backend"""
+        return (
+            self.embedding_device == 'cpu'
+            and self.embedding_backend == 'torch'
+            and num_texts >= self.PARALLEL_EMBEDDING_MIN_TEXTS
+            and (os.cpu_count() or 1) > 1
+        )
+    
+    def _embed_in_processes(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Encode contiguous shards of texts in worker processes, or None if the pool fails"""
+        cpu_count = os.cpu_count() or 1
+        num_shards = min(cpu_count, 8)
+        shard_size = -(-len(texts) // num_shards)
+        shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+        num_threads = max(1, cpu_count // len(shards))
+        try:
+            # Spawned workers start clean instead of forking the parent's torch and batcher threads
+            with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as executor:
+                parts = list(executor.map(
+                    _embed_shard,
+                    [self.embedding_model] * len(shards),
+                    shards,
+                    [self.EMBEDDING_BATCH_SIZE] * len(shards),
+                    [num_threads] * len(shards),
+                ))
+            return np.vstack(parts).astype(np.float32)
+        except Exception as e:
+            logger.error(f"Parallel embedding failed, embedding in-process: {str(e)}")
+            return None
+    
+    def _build_index(self, vectors: np.ndarray):
+        """Build a trained, empty FAISS index for normalized embeddings"""
+        import faiss
+        
+        dimension = vectors.shape[1]
+        metric = faiss.METRIC_INNER_PRODUCT
+        index_type = self.index_type
+        if index_type == "ivfpq" and len(vectors) < self.IVF_MIN_TRAINING_POINTS:
+            logger.info(f"Only {len(vectors)} vectors; using HNSW instead of IVF-PQ")
+            index_type = "hnsw"
+        
+        if index_type == "ivfpq":
+            # Inverted lists over product-quantized codes: only nprobe lists are scanned per query
+            nlist = max(1, min(int(4 * np.sqrt(len(vectors))), len(vectors) // 39))
+            sub_quantizers = next(m for m in (48, 32, 16, 8, 4, 2, 1) if dimension % m == 0)
+            index = faiss.IndexIVFPQ(faiss.IndexFlatIP(dimension), dimension, nlist, sub_quantizers, 8, metric)
+        elif index_type == "hnsw":
+            # Graph index: sub-linear search instead of scanning every vector per query
+            if self.quantization == "int8":
+                index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, self.HNSW_M, metric)
+            else:
+                index = faiss.IndexHNSWFlat(dimension, self.HNSW_M, metric)
+            index.hnsw.efConstruction = self.HNSW_EF_CONSTRUCTION
+        elif self.quantization == "int8":
+            # 8-bit scalar quantization: ~4x smaller than fp32 with int8 SIMD distance kernels
+            index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, metric)
+        else:
+            index = faiss.IndexFlatIP(dimension)
+        
+        if not index.is_trained:
+            index.train(self._training_sample(vectors))
+        self._configure_search(index)
+        return index
+    
+    def _training_sample(self, vectors: np.ndarray) -> np.ndarray:
+        """Subsample large corpora so codebook training cost stays bounded"""
+        if len(vectors) <= self.MAX_TRAINING_POINTS:
+            return vectors
+        rng = np.random.default_rng(0)
+        return vectors[rng.choice(len(vectors), self.MAX_TRAINING_POINTS, replace=False)]
+    
+    def _configure_search(self, index) -> None:
+        """Apply query-time search parameters to the index"""
+        if hasattr(index, 'hnsw'):
+            index.hnsw.efSearch = self.hnsw_ef_search
+        if hasattr(index, 'nprobe'):
+            index.nprobe = self.ivf_nprobe
+    
+    def set_search_params(self, ef_search: Optional[int] = None, nprobe: Optional[int] = None) -> None:
+        """Trade recall for latency at query time without rebuilding the index"""
+        if ef_search is not None:
+            self.hnsw_ef_search = ef_search
+        if nprobe is not None:
+            self.ivf_nprobe = nprobe
+        if self.vector_store:
+            self._configure_search(self.vector_store.index)
+            self.vector_store_version += 1
+    
+    def add_documents(self, documents: List[Document]) -> int:
+        """Add new documents to existing vector store and return how many were added"""
         try:
             if not self.vector_store:
                 raise ValueError("Vector store not initialized")
             
             if not documents:
                 logger.warning("No documents to add")
-                return
+                return 0
+            
+            if self._index_mmapped:
+                # A mapped index is read-only and clone_index rejects its OnDiskInvertedLists,
+                # so read the saved file into memory again before writing to it
+                import faiss
+                
+                self.vector_store.index = faiss.read_index(self._index_path)
+                self._configure_search(self.vector_store.index)
+                self._index_mmapped = False
             
-            self.vector_store.add_documents(documents)
+            self._attach_previews(documents)
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            vectors = self._embed_texts(texts)
+            self._add_vectors(texts, metadatas, vectors)
+            self._build_metadata_cache()
+            self.vector_store_version += 1
             logger.info(f"Added {len(documents)} documents to vector store")
+            return len(documents)
             
         except Exception as e:
             logger.error(f"Error adding documents to vector store: {str(e)}")
@@ -62,16 +414,15 @@ class VectorStoreManager:
                 raise ValueError("Vector store not initialized")
             
             os.makedirs(path, exist_ok=True)
-            self.vector_store.save_local(path)
-            
-            # Save metadata
-            metadata = {
-                'embedding_model': self.embedding_model,
-                'num_documents': self.vector_store.index.ntotal
-            }
-            
-            with open(os.path.join(path, 'metadata.pkl'), 'wb') as f:
-                pickle.dump(metadata, f)
+            # Write next to the live files and swap them in with os.replace: a memory-mapped
+            # index keeps reading its old inode, and a crash never leaves a half-written store
+            staging = tempfile.mkdtemp(prefix='.saving-', dir=path)
+            try:
+                self._write_vector_store(staging)
+                for name in os.listdir(staging):
+                    os.replace(os.path.join(staging, name), os.path.join(path, name))
+            finally:
+                shutil.rmtree(staging, ignore_errors=True)
             
             logger.info(f"Vector store saved to {path}")
             
@@ -79,25 +430,68 @@ class VectorStoreManager:
             logger.error(f"Error saving vector store: {str(e)}")
             raise
     
-    def load_vector_store(self, path: str) -> Optional[FAISS]:
+    def _write_vector_store(self, path: str) -> None:
+        """Write the index, docstore and metadata sidecar into path"""
+        self.vector_store.save_local(path)
+        
+        # The trained quantizer codebook is serialized with the index by save_local
+        metadata = {
+            'embedding_model': self.embedding_model,
+            'num_documents': self.vector_store.index.ntotal,
+            'index_type': self.index_type,
+            'quantization': self.quantization,
+            'code_size': getattr(self.vector_store.index, 'code_size', None),
+            'is_ivf': hasattr(self.vector_store.index, 'nprobe')
+        }
+        
+        with open(os.path.join(path, self.METADATA_FILE), 'wb') as f:
+            f.write(msgpack.packb(metadata))
+    
+    def load_vector_store(self, path: str) -> Optional["FAISS"]:
         """Load vector store from disk"""
+        import faiss
+        from langchain_community.vectorstores import FAISS
+        from langchain_community.vectorstores.utils import DistanceStrategy
+        
         try:
             if not os.path.exists(path):
                 logger.warning(f"Vector store path does not exist: {path}")
                 return None
             
-            self.vector_store = FAISS.load_local(
-                path, 
-                self.embeddings,
-                allow_dangerous_deserialization=True
-            )
+            metadata = self._load_metadata(path)
+            self._index_path = os.path.join(path, 'index.faiss')
+            # IO_FLAG_MMAP only maps the inverted lists of IVF indexes; HNSW, flat and SQ
+            # indexes are read fully either way, so only IVF stores are opened mapped
+            if self.mmap_index and metadata is not None and metadata.get('is_ivf'):
+                # Pages of the inverted lists load on demand and are shared between processes
+                index = faiss.read_index(
+                    self._index_path,
+                    faiss.IO_FLAG_MMAP | getattr(faiss, 'IO_FLAG_READ_ONLY', 0)
+                )
+                with open(os.path.join(path, 'index.pkl'), 'rb') as f:
+                    docstore, index_to_docstore_id = pickle.load(f)
+                self.vector_store = FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+                self._index_mmapped = True
+            else:
+                self.vector_store = FAISS.load_local(
+                    path, 
+                    self.embeddings,
+                    allow_dangerous_deserialization=True
+                )
+                self._index_mmapped = False
+            if self.vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+                self.vector_store.distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+            self._configure_search(self.vector_store.index)
+            self._build_metadata_cache()
+            self.vector_store_version += 1
             
-            # Load metadata if available
-            metadata_path = os.path.join(path, 'metadata.pkl')
-            if os.path.exists(metadata_path):
-                with open(metadata_path, 'rb') as f:
-                    metadata = pickle.load(f)
+            if metadata is not None:
                 logger.info(f"Loaded vector store with {metadata.get('num_documents', 'unknown')} documents")
+                if metadata.get('quantization', self.quantization) != self.quantization:
+                    logger.warning(
+                        f"Vector store was built with quantization={metadata['quantization']}, "
+                        f"configured {self.quantization}; rebuild it to apply the new setting"
+                    )
             
             logger.info(f"Vector store loaded from {path}")
             return self.vector_store
@@ -106,32 +500,121 @@ class VectorStoreManager:
             logger.error(f"Error loading vector store: {str(e)}")
             return None
     
-    def similarity_search(self, query: str, k: int = 4, filter_dict: Optional[Dict] = None) -> List[Document]:
+    def _load_metadata(self, path: str) -> Optional[Dict[str, Any]]:
+        """Read the store's metadata sidecar, accepting the pickle format of older saves"""
+        metadata_path = os.path.join(path, self.METADATA_FILE)
+        if os.path.exists(metadata_path):
+            with open(metadata_path, 'rb') as f:
+                return msgpack.unpackb(f.read())
+        
+        legacy_path = os.path.join(path, self.LEGACY_METADATA_FILE)
+        if os.path.exists(legacy_path):
+            with open(legacy_path, 'rb') as f:
+                return pickle.load(f)
+        return None
+    
+    def similarity_search(self, query: str, k: int = 4, filter_dict: Optional[Dict] = None,
+                          score_threshold: Optional[float] = None) -> List[Document]:
         """Perform similarity search"""
         try:
             if not self.vector_store:
                 raise ValueError("Vector store not initialized")
             
-            if filter_dict:
-                # FAISS doesn't support metadata filtering directly
-                # We'll implement a simple post-filtering approach
-                results = self.vector_store.similarity_search(query, k=k*2)
-                filtered_results = []
-                
-                for doc in results:
-                    if all(doc.metadata.get(key) == value for key, value in filter_dict.items()):
-                        filtered_results.append(doc)
-                        if len(filtered_results) >= k:
-                            break
-                
-                return filtered_results[:k]
-            else:
-                return self.vector_store.similarity_search(query, k=k)
+            filter_items = tuple(sorted(filter_dict.items())) if filter_dict else None
+            return list(self._cached_search(query, k, filter_items, score_threshold, self.vector_store_version))
                 
         except Exception as e:
             logger.error(f"Error performing similarity search: {str(e)}")
             return []
     
+    def _search(self, query: str, k: int, filter_items: Optional[tuple], score_threshold: Optional[float],
+                version: int) -> tuple:
+        """Run an uncached similarity search; version only keys the cache"""
+        threshold_kwargs = {} if score_threshold is None else {"score_threshold": score_threshold}
+        if filter_items:
+            if self._meta_index is not None:
+                return self._filtered_search(query, k, filter_items)
+            # No metadata index: over-fetch and post-filter
+            results = self.vector_store.similarity_search(query, k=k*2, **threshold_kwargs)
+            return tuple(
+                doc for doc in results
+                if all(doc.metadata.get(key) == value for key, value in filter_items)
+            )[:k]
+        return tuple(self.vector_store.similarity_search(query, k=k, **threshold_kwargs))
+    
+    def _filtered_search(self, query: str, k: int, filter_items: tuple) -> tuple:
+        """Search only the vectors whose metadata matches every filter item"""
+        ids = None
+        for item in filter_items:
+            matches = self._meta_index.get(item)
+            if matches is None:
+                return ()
+            ids = matches if ids is None else np.intersect1d(ids, matches, assume_unique=True)
+        if not len(ids):
+            return ()
+        
+        query_vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+        positions = None
+        if len(ids) <= self.EXACT_FILTER_MAX_CANDIDATES:
+            positions = self._exact_top_k(ids, query_vector[0], k)
+        if positions is None:
+            positions = self._index_top_k(ids, query_vector, k)
+        
+        index_to_docstore_id = self.vector_store.index_to_docstore_id
+        docstore = self.vector_store.docstore
+        return tuple(
+            docstore.search(index_to_docstore_id[position])
+            for position in positions if position != -1
+        )
+    
+    def _exact_top_k(self, ids: np.ndarray, query_vector: np.ndarray, k: int) -> Optional[np.ndarray]:
+        """Score the candidates' decoded index rows directly and return the best k positions"""
+        # Decoding the SQ8 codes on demand avoids keeping a second full-precision copy of the store
+        try:
+            rows = self.vector_store.index.reconstruct_batch(ids)
+        except RuntimeError:
+            # IVF indexes without a direct map cannot reconstruct; search over the selector instead
+            return None
+        scores = rows @ query_vector
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(ids))
+        return ids[top[np.argsort(-scores[top])]]
+    
+    def _index_top_k(self, ids: np.ndarray, query_vector: np.ndarray, k: int) -> np.ndarray:
+        """Search the FAISS index restricted to the candidate ids"""
+        import faiss
+        
+        # The index skips non-matching ids itself, so k results come back whenever k docs match
+        selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+        index = self.vector_store.index
+        if hasattr(index, 'hnsw'):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(self.hnsw_ef_search, k))
+        elif hasattr(index, 'nprobe'):
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self.ivf_nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        
+        _, positions = index.search(query_vector, min(k, len(ids)), params=params)
+        return positions[0]
+    
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4) -> List[Document]:
+        """Perform similarity search with an already computed query embedding"""
+        try:
+            if not self.vector_store:
+                raise ValueError("Vector store not initialized")
+            
+            return self.vector_store.similarity_search_by_vector(list(embedding), k=k)
+            
+        except Exception as e:
+            logger.error(f"Error performing similarity search by vector: {str(e)}")
+            return []
+    
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed query texts once so fixed questions can skip the encoder later"""
+        return self._embed_texts(texts).tolist()
+    
     def similarity_search_with_score(self, query: str, k: int = 4) -> List[tuple]:
         """Perform similarity search with relevance scores"""
         try:
@@ -149,5 +632,63 @@ class VectorStoreManager:
         if not self.vector_store:
             raise ValueError("Vector store not initialized")
         
-        search_kwargs = search_kwargs or {"k": 4}
-        return self.vector_store.as_retriever(search_kwargs=search_kwargs)
\ No newline at end of file
+        # Chain retrieval goes through the LRU-cached search rather than the raw FAISS retriever
+        return CachedRetriever(manager=self, search_kwargs=search_kwargs or {"k": 4})
+    
+    def _attach_previews(self, documents: List[Document]) -> None:
+        """Store the display preview on each document once, at ingestion"""
+        for doc in documents:
+            doc.metadata['preview'] = make_preview(doc.page_content)
+    
+    def _build_metadata_cache(self) -> None:
+        """Build a struct-of-arrays sidecar of document metadata keyed by docstore id"""
+        try:
+            row_index = {}
+            source_files, subjects, topics, previews = [], [], [], []
+            is_pdf, has_subject = [], []
+            meta_positions: Dict[Tuple[str, Any], List[int]] = {}
+            
+            for position, doc_id in self.vector_store.index_to_docstore_id.items():
+                doc = self.vector_store.docstore.search(doc_id)
+                if not isinstance(doc, Document):
+                    continue
+                metadata = doc.metadata
+                for key, value in metadata.items():
+                    if key != 'preview' and isinstance(value, (str, int, float, bool)):
+                        meta_positions.setdefault((key, value), []).append(position)
+                row_index[doc_id] = len(source_files)
+                source_files.append(metadata.get('source_file', 'Unknown'))
+                subjects.append(metadata.get('subject', 'General'))
+                topics.append(metadata.get('topic', 'N/A'))
+                previews.append(metadata.get('preview') or make_preview(doc.page_content))
+                is_pdf.append(metadata.get('file_type') == 'pdf')
+                has_subject.append(metadata.get('subject') != 'general')
+            
+            self.doc_meta_soa = {
+                'row_index': row_index,
+                'source_files': source_files,
+                'subjects': subjects,
+                'topics': topics,
+                'previews': previews,
+                'is_pdf': np.array(is_pdf, dtype=bool),
+                'has_subject': np.array(has_subject, dtype=bool),
+            }
+            # Inverted (key, value) -> sorted FAISS ids, used to restrict filtered searches
+            self._meta_index = {
+                item: np.array(positions, dtype=np.int64) for item, positions in meta_positions.items()
+            }
+        except Exception as e:
+            logger.error(f"Error building metadata cache: {str(e)}")
+            self.doc_meta_soa = None
+            self._meta_index = None
+    
+    def get_metadata_rows(self, documents: List[Document]) -> Optional[np.ndarray]:
+        """Map retrieved documents to rows of the metadata cache, or None if any is missing"""
+        if not self.doc_meta_soa or not documents:
+            return None
+        
+        row_index = self.doc_meta_soa['row_index']
+        rows = [row_index.get(getattr(doc, 'id', None)) for doc in documents]
+        if any(row is None for row in rows):
+            return None
+        return np.array(rows, dtype=np.intp)